@@ -1,88 +1,122 @@
 import numpy as np
-import cv2
 import torch
 from PIL import Image, ImageDraw
 
 from BallTrackNet import BallTrackerNet
-
-def combine_three_frames(frame1, frame2, frame3, width, height):
-    # Resize and type converting for each frame
-    img = cv2.resize(frame1, (width, height))
-    # input must be float type
-    img = img.astype(np.float32)
-
-    # resize it
-    img1 = cv2.resize(frame2, (width, height))
-    # input must be float type
-    img1 = img1.astype(np.float32)
-
-    # resize it
-    img2 = cv2.resize(frame3, (width, height))
-    # input must be float type
-    img2 = img2.astype(np.float32)
-
-    # combine three imgs to  (width , height, rgb*3)
-    imgs = np.concatenate((img, img1, img2), axis=2)
-
-    # since the odering of TrackNet  is 'channels_first', so we need to change the axis
-    imgs = np.rollaxis(imgs, 2, 0)
-    return np.array(imgs)
-
+from preprocess import FrameRing
+from track import OnlineTracker
 
 class BallDetector:
     """
     Ball Detector model responsible for receiving the frames and detecting the ball
     """
-    def __init__(self, save_state, out_channels=2):
-        self.device = torch.device("cpu")
+    def __init__(self, save_state, input_size, out_channels=2, online=False, device='cpu', threads=None, batch_size=8):
+        """
+        :param save_state: path to the checkpoint, {'model_state': ...}
+        :param input_size: (height, width) of the model input the weights were trained at, the checkpoint does not hold it
+        :param device: torch device of the model, e.g. 'cpu' or 'cuda'
+        :param threads: number of CPU threads of torch, torch decides by default
+        :param batch_size: maximum number of inputs of one forward pass in detect_batch
+        """
+        self.device = torch.device(device)
+        if threads:
+            torch.set_num_threads(threads)
         # Load TrackNet model weights
         self.detector = BallTrackerNet(out_channels=out_channels)
         saved_state_dict = torch.load(save_state, map_location=torch.device("cpu"))
         self.detector.load_state_dict(saved_state_dict['model_state'])
         self.detector.eval().to(self.device)
 
-        self.current_frame = None
-        self.last_frame = None
-        self.before_last_frame = None
-
         self.video_width = None
         self.video_height = None
-        self.model_input_width = 640
-        self.model_input_height = 360
+        self.model_input_height, self.model_input_width = (int(v) for v in input_size)
+
+        # every frame is preprocessed once and kept for the next 2 inputs
+        self.frame_ring = FrameRing(self.model_input_height, self.model_input_width)
+        self.batch_size = batch_size
+        self.input = np.empty((batch_size, 9, self.model_input_height, self.model_input_width), dtype=np.float32)
 
         self.threshold_dist = 100
-        self.xy_coordinates = np.array([[None, None], [None, None]])
+        # Kalman filter instead of the distance check against the last point
+        self.tracker = OnlineTracker(max_dist=self.threshold_dist) if online else None
+        # ball coordinates of every frame, NaN if not tracked, the capacity doubles when it is full
+        self._coordinates = np.full((1024, 2), np.nan)
+        self.num_coordinates = 2 # the first 2 frames have no 3-frame input
 
         self.bounces_indices = []
 
+    @property
+    def xy_coordinates(self):
+        """ (number of frames, 2) array of the ball coordinates, NaN if the ball is not tracked"""
+        return self._coordinates[:self.num_coordinates]
+
+    def last_ball(self):
+        """ Ball coordinates of the last frame, (None, None) if not tracked"""
+        x, y = self._coordinates[self.num_coordinates - 1]
+        if np.isnan(x):
+            return None, None
+        return int(x), int(y)
+
+    def _append(self, x, y):
+        if self.num_coordinates == len(self._coordinates):
+            grown = np.full((2*len(self._coordinates), 2), np.nan)
+            grown[:self.num_coordinates] = self._coordinates
+            self._coordinates = grown
+        self._coordinates[self.num_coordinates] = (np.nan, np.nan) if x is None else (x, y)
+        self.num_coordinates += 1
+
+    def _postprocess(self, x, y):
+        if x is not None:
+            # Rescale the indices to fit frame dimensions
+            x = int(x * (self.video_width / self.model_input_width))
+            y = int(y * (self.video_height / self.model_input_height))
+
+            # Check distance from previous location and remove outliers
+            last = self._coordinates[self.num_coordinates - 1]
+            if self.tracker is None and not np.isnan(last[0]):
+                if np.linalg.norm(np.array([x,y]) - last) > self.threshold_dist:
+                    x, y = None, None
+        if self.tracker is not None:
+            # accept or reject the detection and fill short gaps
+            x, y, _, _ = self.tracker.update(x, y)
+            if x is not None:
+                x, y = int(x), int(y)
+        self._append(x, y)
+
     def detect_ball(self, frame):
         """
         After receiving 3 consecutive frames, the ball will be detected using TrackNet model
         :param frame: current frame
         """
+        self.detect_batch([frame])
+
+    def detect_batch(self, frames):
+        """
+        Detect the ball on a chunk of consecutive frames, with one forward pass per batch_size frames
+        :param frames: list of consecutive frames, following the frames of the previous call
+        """
         # Save frame dimensions
-        if self.video_width is None:
-            self.video_width = frame.shape[1]
-            self.video_height = frame.shape[0]
-        self.last_frame = self.before_last_frame
-        self.before_last_frame = self.current_frame
-        self.current_frame = frame.copy()
+        if self.video_width is None and len(frames):
+            self.video_width = frames[0].shape[1]
+            self.video_height = frames[0].shape[0]
 
-        # detect only in 3 frames were given
-        if self.last_frame is not None:
-            # combine the frames into 1 input tensor
-            frames = combine_three_frames(self.current_frame, self.before_last_frame, self.last_frame,
-                                          self.model_input_width, self.model_input_height)
-            frames = (torch.from_numpy(frames) / 255).to(self.device)
-            # Inference (forward pass)
-            x, y = self.detector.inference(frames)
-            if x is not None:
-                # Rescale the indices to fit frame dimensions
-                x = int(x * (self.video_width / self.model_input_width))
-                y = int(y * (self.video_height / self.model_input_height))
+        n = 0
+        for frame in frames:
+            self.frame_ring.push(frame)
+            # detect only in 3 frames were given
+            if not self.frame_ring.ready():
+                continue
+            # combine the frames into 1 input
+            self.frame_ring.triplet(out=self.input[n])
+            n += 1
+            if n == self.batch_size:
+                self._detect(n)
+                n = 0
+        if n:
+            self._detect(n)
 
-                # Check distance from previous location and remove outliers
-                if self.xy_coordinates[-1][0] is not None:
-                    if np.linalg.norm(np.array([x,y]) - self.xy_coordinates[-1]) > self.threshold_dist:
-                        x, y = None, None
-            self.xy_coordinates = np.append(self.xy_coordinates, np.array([[x, y]]), axis=0)
\ No newline at end of file
+    def _detect(self, n):
+        inputs = torch.from_numpy(self.input[:n]).to(self.device)
+        # Inference (forward pass)
+        for x, y in self.detector.inference_batch(inputs):
+            self._postprocess(x, y)
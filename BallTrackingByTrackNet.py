@@ -22,37 +22,46 @@ def main():
     out = cv2.VideoWriter('Video/video3_TN.mp4', fourcc, 30.0, (w, h)) # more fps, more quickly to run
 
 
-    ball_detector = BallDetector('TrackNet/Weights.pth', out_channels=2)
+    ball_detector = BallDetector('TrackNet/Weights.pth', (360, 640), out_channels=2) # trained at 360x640
 
     ball = None
     balls = [] # Collect the tracked balls
     # kernel = np.ones((4,4),np.uint8)
 
-    while video.isOpened():
-        ret, frames = video.read()
-        
-        if frames is None:
-            print("No more successfully read this video!")
-            break
-            
-        ballPre = ball
-       
-        # ball_detector.detect_ball(blurFrame)
-        ball_detector.detect_ball(frames) # No dilate, eroded and GaussianBlur processing
-
-        if ball_detector.xy_coordinates[-1][0] is not None:
-            ball = ball_detector.xy_coordinates[-1]
-            balls.append(ball)
-            cv2.circle(frames, ball, 4, (0,0,255), 3)
-            cv2.circle(frames, ballPre1, 3, (0,0,255), 2)
-           
-        # print('Balls:', len(balls))
-
-        
-        cv2.imshow("Frames", frames)
-        out.write(frames)
-        if cv2.waitKey(1) == ord("q"):
-            break
+    # the frames are read in chunks, each chunk is one forward pass of detect_batch
+    chunk_size = ball_detector.batch_size
+    num = 0 # index of the first frame of the chunk
+    done = False
+    while not done and video.isOpened():
+        chunk = []
+        while len(chunk) < chunk_size:
+            ret, frame = video.read()
+            if frame is None:
+                print("No more successfully read this video!")
+                done = True
+                break
+            chunk.append(frame)
+
+        # ball_detector.detect_batch(blurFrames)
+        ball_detector.detect_batch(chunk) # No dilate, eroded and GaussianBlur processing
+
+        for frame, (x, y) in zip(chunk, ball_detector.xy_coordinates[num:num + len(chunk)]):
+            ballPre = ball
+            if not np.isnan(x):
+                ball = (int(x), int(y))
+                balls.append(ball)
+                cv2.circle(frame, ball, 4, (0,0,255), 3)
+                if ballPre is not None:
+                    cv2.circle(frame, ballPre, 3, (0,0,255), 2)
+
+            # print('Balls:', len(balls))
+
+            cv2.imshow("Frames", frame)
+            out.write(frame)
+            if cv2.waitKey(1) == ord("q"):
+                done = True
+                break
+        num += len(chunk)
 
     print("The total number of ball tracked:", len(balls))
 
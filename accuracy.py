@@ -1,30 +1,35 @@
 import numpy as np
+import pandas as pd
 import cv2
 from scipy.spatial import distance
 import tensorflow as tf
-from utils import heatMap, heatMap_1, binary_heatMap, get_input, get_output, WBCE_loss, generate_binary_heatmap
+from utils import heatMap, heatMap_1, binary_heatMap, get_input, get_output, WBCE_loss, generate_binary_heatmap, model_input_size
+from labels import HeatmapStamper
+from video_source import read_video_samples
 
 
-def validate(model, validation_data, n_classes=256, input_height=360, input_width=640, output_height=720, output_width=1280, min_dist=5): 
+def validate(model, validation_data, n_classes=256, input_height=None, input_width=None, output_height=720, output_width=1280, min_dist=5, frame_store=None, stamper=None): 
     """originally n_classes=256 for sparceCategoricalCrossEntropy, 
         n_classes=1 for WBCE_loss
+        input_height, input_width: read from the model by default
+        frame_store: optional FrameStore (see frame_store.py) of the model resolution, instead of reading the JPEGs
+        stamper: optional HeatmapStamper (see labels.py) to draw the heatmaps from the coordinates
     """
+    if input_height is None or input_width is None:
+        input_height, input_width = model_input_size(model)
 
     tp = [0, 0, 0, 0]
     fp = [0, 0, 0, 0]
     tn = [0, 0, 0, 0]
     fn = [0, 0, 0, 0]
     losses = []
-    num_samples = len(validation_data[0]) # validation_data is a dictionary
+    num_samples = len(validation_data) # validation_data is a LabelIndex
+    samples = csv_samples(validation_data, input_height, input_width, frame_store, with_output=stamper is None)
 
     print("num_samples ", num_samples)
 
-    for iter in range(num_samples):
-        
-        path, path_prev, path_preprev, path_gt, x_gt, y_gt, status, vis = validation_data[0][iter], validation_data[1][iter], validation_data[2][iter], validation_data[3][iter], validation_data[4][iter], validation_data[5][iter], validation_data[6][iter], validation_data[7][iter]
-        
-        imgs = get_input(input_height, input_width, path, path_prev, path_preprev) # combine 3 frames 
-        
+    for iter, (imgs, y_true, x_gt, y_gt, vis) in enumerate(samples):
+
         prediction = model.predict(np.array([imgs]), verbose=0)[0]
         x_pred, y_pred = heatMap(prediction, n_classes, input_height, input_width, output_height, output_width)
         
@@ -53,7 +58,8 @@ def validate(model, validation_data, n_classes=256, input_height=360, input_widt
         recall = sum(tp) / (vc1 + vc2 + vc3 + eps)
         f1 = 2 * precision * recall / (precision + recall + eps)
 
-        y_true = get_output(input_height, input_width, path_gt)
+        if stamper is not None:
+            y_true = stamper.stamp(x_gt, y_gt, vis)
         scce = tf.keras.losses.SparseCategoricalCrossentropy()
         loss = scce(y_true, prediction).numpy()
         # loss = WBCE_loss(output , y_pred).numpy() # for WBCE_loss
@@ -71,27 +77,74 @@ def validate(model, validation_data, n_classes=256, input_height=360, input_widt
     return np.mean(losses), precision, recall, f1
 
 
+def csv_samples(labels, input_height, input_width, frame_store=None, with_output=True):
+    """ Samples of the LabelIndex of labels_val.csv (see label_index.py), the paths are only built to read the JPEGs
+    :params
+        with_output: read the ground truth heatmaps, False if they are drawn from the coordinates
+    :return
+        generator of (input of the 3 frames, flattened heatmap or None, x, y, visibility)
+    """
+    if frame_store is not None:
+        rows = frame_store.label_rows(labels)
+    coordinates = labels.coordinates()
+    for iter, frames in enumerate(labels.sample_frames()):
+        x_gt, y_gt, vis = coordinates[iter]
+        y_true = None
+        if frame_store is not None:
+            imgs = frame_store.input_at(rows[iter]) # combine 3 frames
+            if with_output:
+                y_true = frame_store.output_at(rows[iter][0])
+        else:
+            imgs = get_input(input_height, input_width, *[labels.frame_path(f) for f in frames]) # combine 3 frames
+            if with_output:
+                y_true = get_output(input_height, input_width, labels.frame_path(frames[0], 'dataset/gaussian_heatmap'))
+        yield imgs, y_true, x_gt, y_gt, vis
+
+
+def video_samples(video_clips, input_height, input_width, output_height, output_width):
+    """ Samples of held-out labelled videos, see video_source.py
+    :return
+        generator of (input of the 3 frames, None, x, y, visibility), x and y at output resolution
+    """
+    for path_video, path_labels in video_clips:
+        for imgs, (x_gt, y_gt, vis) in read_video_samples(path_video, path_labels, input_height, input_width,
+                                                         output_height, output_width):
+            yield imgs, None, x_gt, y_gt, vis
+
+
 # This is for WBCE_loss validation
-def validate_1(model, validation_data, input_height=360, input_width=640, output_height=720, output_width=1280, min_dist=5): 
-# def validate_1(model, validation_data, input_height=360, input_width=640, output_height=360, output_width=640, min_dist=5): 
+def validate_1(model, validation_data, input_height=None, input_width=None, output_height=720, output_width=1280, min_dist=5, frame_store=None, stamper=None, video_clips=None):
+# def validate_1(model, validation_data, input_height=360, input_width=640, output_height=360, output_width=640, min_dist=5):
     """for WBCE_loss
+        input_height, input_width: read from the model by default
+        frame_store: optional FrameStore (see frame_store.py) of the model resolution, instead of reading the JPEGs
+        stamper: optional HeatmapStamper (see labels.py) to draw the heatmaps from the coordinates
+        video_clips: optional (video, labels) paths of held-out videos (video_clips of video_source.py) to validate on
+                     instead of validation_data, the heatmaps are drawn by stamper, a HeatmapStamper by default
     """
+    if input_height is None or input_width is None:
+        input_height, input_width = model_input_size(model)
 
     tp = [0, 0, 0, 0]
     fp = [0, 0, 0, 0]
     tn = [0, 0, 0, 0]
     fn = [0, 0, 0, 0]
     losses = []
-    num_samples = len(validation_data[0]) # validation_data is a dictionary
+    if video_clips is not None:
+        if stamper is None:
+            stamper = HeatmapStamper(input_height, input_width, output_height, output_width)
+        # the labels are scaled to the resolution of the stamper, as in video_dataset
+        output_height, output_width = round(input_height / stamper.scale_y), round(input_width / stamper.scale_x)
+        num_samples = sum(max(len(pd.read_csv(path_labels)) - 2, 0) for _, path_labels in video_clips)
+        samples = video_samples(video_clips, input_height, input_width, output_height, output_width)
+    else:
+        num_samples = len(validation_data) # validation_data is a LabelIndex
+        samples = csv_samples(validation_data, input_height, input_width, frame_store, with_output=stamper is None)
 
     print("num_samples ", num_samples)
 
-    for iter in range(num_samples):
-        
-        path, path_prev, path_preprev, path_gt, x_gt, y_gt, status, vis = validation_data[0][iter], validation_data[1][iter], validation_data[2][iter], validation_data[3][iter], validation_data[4][iter], validation_data[5][iter], validation_data[6][iter], validation_data[7][iter]
-        
-        imgs = get_input(input_height, input_width, path, path_prev, path_preprev) # combine 3 frames 
-        
+    for iter, (imgs, y_true, x_gt, y_gt, vis) in enumerate(samples):
+
         prediction = model.predict(np.array([imgs]), verbose=0)[0]
     
         x_pred, y_pred = heatMap_1(prediction, input_height, input_width, output_height, output_width)
@@ -121,9 +174,10 @@ def validate_1(model, validation_data, input_height=360, input_width=640, output
         recall = sum(tp) / (vc1 + vc2 + vc3 + eps)
         f1 = 2 * precision * recall / (precision + recall + eps)
 
-        y_true = get_output(input_height, input_width,path_gt)
+        if stamper is not None:
+            y_true = stamper.stamp(x_gt, y_gt, vis)
         y_true = np.reshape(y_true, (input_width*input_height))
-        loss = WBCE_loss(y_true , y_pred).numpy()# for WBCE_loss
+        loss = WBCE_loss(y_true, prediction).numpy() # for WBCE_loss, on the predicted heatmap
         losses.append(loss.item())
 
         if iter % 842 == 0: # 842 = 5894/7
@@ -136,3 +190,29 @@ def validate_1(model, validation_data, input_height=360, input_width=640, output
             print("Validation loss:",np.mean(losses))
 
     return np.mean(losses), precision, recall, f1
+
+
+def track_f1(ball_track, reference, min_dist=5):
+    """ Compare a ball track with a reference track frame by frame, with the counting rule of validate,
+    e.g. a strided track (see stride.py) with the dense track of the same video, or a track with the labels
+    :params
+        ball_track: list of (x, y) ball points, (None, None) if not tracked
+        reference: list of (x, y) ball points of the same frames, (None, None) if the ball is not visible
+        min_dist: maximum distance of a true positive, in pixels
+    :return
+        precision, recall, f1
+    """
+    tp, fp, fn = 0, 0, 0
+    for (x_pred, y_pred), (x_ref, y_ref) in zip(ball_track, reference):
+        if x_pred is not None:
+            if x_ref is not None and distance.euclidean((x_pred, y_pred), (x_ref, y_ref)) < min_dist:
+                tp += 1
+            else:
+                fp += 1
+        elif x_ref is not None:
+            fn += 1
+    eps = 1e-15
+    precision = tp / (tp + fp + eps)
+    recall = tp / (tp + fn + eps)
+    f1 = 2 * precision * recall / (precision + recall + eps)
+    return precision, recall, f1
@@ -0,0 +1,122 @@
+## Run the ball tracking on many videos at once, e.g. a whole tournament, with a pool of worker processes.
+# Every worker loads the model once and keeps it resident for all the videos it gets.
+# The track (<video>_track.npy, see load_track in track.py) and the rendered video (<video>_track.mp4) are written next to each input video.
+# python batch_infer.py --input_path media/tournament --workers 2 --intra_op_threads 4 --inter_op_threads 1
+
+import argparse, os, sys
+import multiprocessing
+from pathlib import Path
+import time
+import tensorflow as tf
+from export import load_inference_model
+from infer import read_video_stream, infer_stream, positive_int
+from stream import remove_outliers_stream, record_track, write_track_stream
+from track import make_track_file, save_track
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+_model = None # the model of this worker process
+_options = None
+
+
+def list_videos(input_path):
+    """ Get the videos to process
+    :params
+        input_path: directory of videos, or manifest file with one video path per line
+    :return
+        videos: list of video paths
+    """
+    if os.path.isdir(input_path):
+        return sorted(str(p) for p in Path(input_path).iterdir()
+                      if p.suffix.lower() in VIDEO_EXTENSIONS and not p.stem.endswith('_track'))
+    with open(input_path) as f:
+        lines = [line.strip() for line in f]
+    root = os.path.dirname(input_path)
+    return [os.path.join(root, line) for line in lines if line and not line.startswith('#')]
+
+
+def init_worker(model_path, batch_size, serving, wbce, render, intra_op_threads, inter_op_threads):
+    """ Load the model once per worker process"""
+    global _model, _options
+    # must be set before TensorFlow runs any operation in this process
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    _model = load_inference_model(model_path, batch_size, serving=serving)
+    _options = {'batch_size': batch_size, 'wbce': wbce, 'render': render}
+
+
+def process_video(path_video):
+    """ Track the ball in one video with the resident model of the worker, an error only fails this video
+    :return
+        path_video, number of frames, running time in seconds, error message or None
+    """
+    start = time.time()
+    try:
+        n_frames = track_video(path_video)
+    except Exception as e: # e.g. a corrupt or unreadable video
+        return path_video, 0, time.time() - start, f"{type(e).__name__}: {e}"
+    return path_video, n_frames, time.time() - start, None
+
+
+def track_video(path_video):
+    """ Write the track and the rendered video of one video
+    :return
+        number of frames
+    """
+    stem = os.path.splitext(path_video)[0]
+    frames, fps = read_video_stream(path_video)
+    detections = []
+    ball_track = []
+    confs = []
+    stream = record_track(infer_stream(frames, _model, _options['wbce'], _options['batch_size'], confs=confs), detections)
+    stream = record_track(remove_outliers_stream(stream), ball_track)
+
+    if _options['render']:
+        write_track_stream(stream, stem + '_track.mp4', fps)
+    else:
+        for _ in stream:
+            pass
+
+    save_track(stem + '_track.npy', make_track_file(detections, ball_track, fps, confs))
+    return len(ball_track)
+
+
+if __name__ == '__main__':
+    root = Path(__file__).parent
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_path', type=str, help='directory of videos, or manifest file with one video path per line')
+    parser.add_argument('--saved_model_path', type=str, default = os.path.join(root, 'models/tracknet.keras'), help='path to .keras model or exported model directory')
+    parser.add_argument('--batch_size', type=positive_int, default=2, help='number of consecutive 3-frame inputs predicted in one forward pass')
+    parser.add_argument('--workers', type=positive_int, default=2, help='number of worker processes, each one keeps a model loaded')
+    parser.add_argument('--intra_op_threads', type=int, default=0, help='TensorFlow intra-op threads per worker, 0 lets TensorFlow decide')
+    parser.add_argument('--inter_op_threads', type=int, default=0, help='TensorFlow inter-op threads per worker, 0 lets TensorFlow decide')
+    parser.add_argument('--serving', default = False, action='store_true', help='decode the heatmap inside the graph')
+    parser.add_argument('--wbce', default = False, action='store_true', help='the model is TrackNet2(U-Net+Sigmoid) + WBCE-loss')
+    parser.add_argument('--no_render', default = False, action='store_true', help='only write the tracks, not the rendered videos')
+    args = parser.parse_args()
+
+    videos = list_videos(args.input_path)
+    print("videos:", len(videos))
+
+    start = time.time()
+    total_frames = 0
+    failures = [] # (path_video, error message)
+    # spawn, so every worker starts its own TensorFlow runtime
+    with multiprocessing.get_context('spawn').Pool(args.workers, initializer=init_worker,
+                                                   initargs=(args.saved_model_path, args.batch_size, args.serving, args.wbce,
+                                                             not args.no_render, args.intra_op_threads, args.inter_op_threads)) as pool:
+        for path_video, n_frames, run_time, error in pool.imap_unordered(process_video, videos):
+            if error is not None:
+                failures.append((path_video, error))
+                print(f"{path_video}: failed, {error}")
+                continue
+            total_frames += n_frames
+            print(f"{path_video}: {n_frames} frames in {run_time:.1f}s, {n_frames/max(run_time, 1e-9):.1f} frames/s")
+
+    run_time = time.time() - start
+    print(f"Total: {total_frames} frames in {run_time:.1f}s, {total_frames/max(run_time, 1e-9):.1f} frames/s")
+    if failures:
+        print(f"Failed: {len(failures)} of {len(videos)} videos")
+        for path_video, error in failures:
+            print(f"  {path_video}: {error}")
+        sys.exit(1)
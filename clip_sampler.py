@@ -0,0 +1,131 @@
+## Clip locality for TrackNetDataset. labels_train.csv is shuffled globally, so the frames a sample shares with its
+# neighbouring samples are decoded again for every sample. ClipSampler draws the batches from a few resident clips at
+# a time, still in random order, and SharedFrameCache keeps the decoded frames of the resident clips, so a frame,
+# which is in 3 samples, is decoded about once.
+
+import multiprocessing
+import os
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class ClipSampler:
+    """
+    Random batches drawn from a rotating set of resident clips
+    """
+    def __init__(self, clip_ids, batch_size=2, resident_clips=8, seed=None):
+        """
+        :params
+            clip_ids: clip of every sample, e.g. LabelIndex.clip_ids of labels_train.csv
+            batch_size: batch size
+            resident_clips: number of clips the samples are drawn from at a time
+            seed: seed of the random order
+        """
+        self.batch_size = batch_size
+        self.resident_clips = resident_clips
+        self.rng = np.random.default_rng(seed)
+        clip_ids = np.asarray(clip_ids)
+        order = np.argsort(clip_ids, kind='stable')
+        starts = np.flatnonzero(np.diff(clip_ids[order], prepend=-1)) # first sample of every clip in order
+        self.clips = [list(samples) for samples in np.split(order, starts[1:])] if len(order) else []
+
+    def epoch(self):
+        """ Order of the samples of one epoch
+        :return
+            list of batches, arrays of sample indexes, every sample is in one batch
+        """
+        waiting = [self.clips[c] for c in self.rng.permutation(len(self.clips))]
+        resident = [] # shuffled samples not drawn yet of every resident clip
+        order = []
+        while waiting or resident:
+            while len(resident) < self.resident_clips and waiting:
+                resident.append(list(self.rng.permutation(waiting.pop())))
+            # clips with more samples left are drawn more often, so the resident clips end at about the same time
+            sizes = np.array([len(samples) for samples in resident], dtype=np.float64)
+            c = self.rng.choice(len(resident), p=sizes / sizes.sum())
+            order.append(resident[c].pop())
+            if not resident[c]: # the next clip comes in
+                resident.pop(c)
+        order = np.array(order, dtype=np.int64)
+        return [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+
+
+def _release(blocks, pid):
+    for block in blocks:
+        if os.getpid() == pid: # only the process that created the blocks removes them
+            block.unlink()
+        try:
+            block.close()
+        except BufferError: # arrays of the cache still point to the block, it is unmapped when they are freed
+            pass
+
+
+class SharedFrameCache:
+    """
+    LRU cache of decoded, resized frames in shared memory, bounded by bytes. The loader threads and the forked loader
+    processes of a dataset share the frames, the counters and the lock.
+    """
+    def __init__(self, input_height=360, input_width=640, max_bytes=2**30):
+        """
+        :params
+            input_height, input_width: model resolution
+            max_bytes: size of the cached frames, uint8 (3, input_height, input_width) each
+        """
+        frame_bytes = 3 * input_height * input_width
+        self.num_slots = max(1, max_bytes // frame_bytes)
+        self._frames_block = shared_memory.SharedMemory(create=True, size=self.num_slots * frame_bytes)
+        self._table_block = shared_memory.SharedMemory(create=True, size=(2 * self.num_slots + 3) * 8)
+        self._finalizer = weakref.finalize(self, _release, [self._frames_block, self._table_block], os.getpid())
+        self._frames = np.ndarray((self.num_slots, 3, input_height, input_width), dtype=np.uint8,
+                                  buffer=self._frames_block.buf)
+        table = np.ndarray((2 * self.num_slots + 3,), dtype=np.int64, buffer=self._table_block.buf)
+        self._keys = table[:self.num_slots] # key of the frame in every slot, -1 if empty
+        self._last_used = table[self.num_slots:2 * self.num_slots] # clock of the last access of every slot
+        self._counters = table[2 * self.num_slots:] # clock, hits, misses
+        self._keys[:] = -1
+        self._last_used[:] = 0
+        self._counters[:] = 0
+        self._lock = multiprocessing.Lock()
+
+    def get(self, key, load):
+        """ Frame of the cache, or load it and cache it
+        :params
+            key: non-negative int key of the frame, the same in every process, e.g. its index in LabelIndex.names
+            load: function key -> uint8 (3, input_height, input_width) frame, called on a miss outside of the lock
+        :return
+            uint8 (3, input_height, input_width) frame, owned by the caller
+        """
+        with self._lock:
+            slot = np.flatnonzero(self._keys == key)
+            self._counters[0] += 1
+            if slot.size:
+                self._last_used[slot[0]] = self._counters[0]
+                self._counters[1] += 1
+                return self._frames[slot[0]].copy()
+            self._counters[2] += 1
+        frame = load(key)
+        with self._lock:
+            if not (self._keys == key).any(): # not cached by another loader in the meantime
+                slot = np.argmin(self._last_used) # least recently used, or empty
+                self._keys[slot] = key
+                self._last_used[slot] = self._counters[0]
+                self._frames[slot] = frame
+        return frame
+
+    @property
+    def hits(self):
+        return int(self._counters[1])
+
+    @property
+    def misses(self):
+        return int(self._counters[2])
+
+    def hit_rate(self):
+        """ Fraction of the frames read from the cache"""
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def close(self):
+        """ Release the shared memory"""
+        self._frames = self._keys = self._last_used = self._counters = None
+        self._finalizer()
@@ -1,6 +1,7 @@
 
 from tensorflow import keras
 from accuracy import validate, validate_1
+from label_index import read_labels
 import cv2,csv
 import tensorflow as tf
 import matplotlib.pyplot as plt
@@ -12,6 +13,15 @@ import time
 
 class ValidationCallback(keras.callbacks.Callback):
 
+    def __init__(self, frame_store=None, stamper=None, video_clips=None):
+        """ frame_store: optional FrameStore (see frame_store.py) to read the validation frames from
+        stamper: optional HeatmapStamper (see labels.py) to draw the validation heatmaps from the coordinates
+        video_clips: optional held-out labelled videos (video_clips of video_source.py) to validate on instead of labels_val.csv"""
+        super().__init__()
+        self.frame_store = frame_store
+        self.stamper = stamper
+        self.video_clips = video_clips
+
     def on_train_begin(self, logs=None):
         self.losses = []
         self.epochs = []
@@ -20,17 +30,14 @@ class ValidationCallback(keras.callbacks.Callback):
         self.recall = []
         self.metrics_epochs = []
         self.val_loss = []
-        validation_data = defaultdict(list)
-        root = Path(__file__).parent
-        validation_csv_path = os.path.join(root, 'labels_val.csv')
+        if self.video_clips is not None: # no labels_val.csv nor JPEGs, see validate_1
+            self.validation_data = None
+            print(f'#validation videos : {len(self.video_clips)}')
+        else:
+            root = Path(__file__).parent
+            validation_csv_path = os.path.join(root, 'labels_val.csv')
 
-        with open(validation_csv_path, 'r', newline='') as f:
-            reader = csv.reader(f)
-            next(reader)  # Skip the header row
-            for row in reader:
-                for i, v in enumerate(row):
-                    validation_data[i].append(v)
-        self.validation_data = validation_data # validation_data is a dictionary
+            self.validation_data = read_labels(validation_csv_path) # a LabelIndex, from labels_val.npz if it exists
         print('Beginning training......')
 
     def on_epoch_begin(self, epoch, logs=None):
@@ -40,7 +47,7 @@ class ValidationCallback(keras.callbacks.Callback):
             print(f"Validating..... at epoch={epoch+1}")
             start = time.time()
             # val_loss, f1, precision, recall = validate(self.model, self.validation_data) # The author created validate() from accuracy.py for SCCE loss
-            val_loss, f1, precision, recall = validate_1(self.model, self.validation_data) # The author created validate() from accuracy.py for WBCE_loss
+            val_loss, f1, precision, recall = validate_1(self.model, self.validation_data, frame_store=self.frame_store, stamper=self.stamper, video_clips=self.video_clips) # The author created validate() from accuracy.py for WBCE_loss
             self.metrics_epochs.append(epoch + 1) # since (epoch+1) % 50 == 0
             self.f1.append(f1)
             self.precision.append(precision)
@@ -7,46 +7,79 @@ import cv2
 import numpy as np
 import math
 from pathlib import Path
+from labels import HeatmapStamper, disk_kernel
+from label_index import read_labels
+from shards import shard_files, read_shard
+from video_source import video_clips, read_video_samples
+from clip_sampler import ClipSampler
 import matplotlib.pyplot as pyplot
 
 
 class TrackNetDataset(tf.keras.utils.Sequence):
 
-    def __init__(self, input_height=360, input_width=640, batch_size=2):
+    def __init__(self, input_height=360, input_width=640, batch_size=2, frame_store=None, stamper=None,
+                 resident_clips=0, frame_cache=None, workers=1, use_multiprocessing=False, max_queue_size=10):
+        """ frame_store: optional FrameStore (see frame_store.py) of the same resolution, the inputs and
+        heatmaps are then sliced from its memory maps instead of decoding the JPEGs
+        stamper: optional HeatmapStamper (see labels.py), the heatmaps are then drawn from the coordinates
+        resident_clips: draw the batches from this number of clips at a time (see clip_sampler.py), 0 for the CSV order
+        frame_cache: optional SharedFrameCache (see clip_sampler.py) of the decoded frames
+        workers, use_multiprocessing, max_queue_size: loaders of the batches during model.fit (keras PyDataset),
+        threads or, with use_multiprocessing, forked processes, which share the frame_cache"""
+        super().__init__(workers=workers, use_multiprocessing=use_multiprocessing, max_queue_size=max_queue_size)
         self.path_dataset = Path(__file__).parent
-        self.data = pd.read_csv(os.path.join(self.path_dataset, 'labels_train.csv'))
-        print(f'#training samples : {self.data.shape[0]}')
+        self.frame_store = frame_store
+        self.stamper = stamper
+        self.frame_cache = frame_cache
+        self.labels = read_labels(os.path.join(self.path_dataset, 'labels_train.csv')) # from labels_train.npz if it exists
+        print(f'#training samples : {len(self.labels)}')
         self.height = input_height
         self.width = input_width
         self.batch_size = batch_size
+        self.frames = self.labels.sample_frames() # (frame, prev, preprev) of every sample, indexes in labels.names
+        self.coordinates = self.labels.coordinates() # x, y, visibility, NaN if not visible
+        self.store_rows = frame_store.label_rows(self.labels) if frame_store is not None else None
+        self.sampler = ClipSampler(self.labels.clip_ids, batch_size, resident_clips) if resident_clips else None
+        self.batches = self.sampler.epoch() if self.sampler is not None else None
 
 
     def __len__(self):
         # Number of batches
-        return (self.data.shape[0] + self.batch_size - 1) // self.batch_size
+        return (len(self.labels) + self.batch_size - 1) // self.batch_size
+
+
+    def on_epoch_end(self):
+        if self.sampler is not None: # a new order of the clips and of their samples
+            self.batches = self.sampler.epoch()
 
 
     def __getitem__(self, batch_idx):
-        start_idx = batch_idx * self.batch_size
-        end_idx = (batch_idx + 1) * self.batch_size
-        batch_data = self.data.iloc[start_idx:end_idx]
+        if self.batches is not None:
+            samples = self.batches[batch_idx]
+        else:
+            start_idx = batch_idx * self.batch_size
+            end_idx = min((batch_idx + 1) * self.batch_size, len(self.labels))
+            samples = range(start_idx, end_idx)
 
         inputs_batch = []
         outputs_batch = []
 
-        for idx in range(len(batch_data)):
-            path, path_prev, path_preprev, path_gt, x, y, status, vis = batch_data.iloc[idx]
-
-            path = os.path.join(self.path_dataset, path)
-            path_prev = os.path.join(self.path_dataset, path_prev)
-            path_preprev = os.path.join(self.path_dataset, path_preprev)
-            path_gt = os.path.join(self.path_dataset, path_gt)
+        for i in samples:
+            x, y, vis = self.coordinates[i]
             if math.isnan(x):
                 x = -1
                 y = -1
-                
-            inputs = self.get_input(path, path_prev, path_preprev)
-            outputs = self.get_output(path_gt) #TrackNet +SCCE loss
+
+            if self.frame_store is not None:
+                inputs = self.frame_store.input_at(self.store_rows[i])
+            else:
+                inputs = self.get_input(*self.frames[i])
+            if self.stamper is not None:
+                outputs = self.stamper.stamp(x, y, vis)
+            elif self.frame_store is not None:
+                outputs = self.frame_store.output_at(self.store_rows[i][0])
+            else:
+                outputs = self.get_output(self.path(self.frames[i][0], 'dataset/gaussian_heatmap')) #TrackNet +SCCE loss
             # outputs = self.generate_binary_heatmap(x, y, 5, 1) # for TrackNet2 + WBCE_loss, ball radius: 5 pixels
             # outputs = np.reshape(outputs, (self.width *self.height))
             inputs_batch.append(inputs)
@@ -55,15 +88,31 @@ class TrackNetDataset(tf.keras.utils.Sequence):
         return np.array(inputs_batch), np.array(outputs_batch)
 
 
-    def get_input(self, path, path_prev, path_preprev):
+    def path(self, frame_id, directory='dataset/images'):
+        """ Path of a frame of labels.names, built only when its JPEG is read"""
+        return os.path.join(self.path_dataset, self.labels.frame_path(frame_id, directory))
+
+
+    def read_frame(self, frame_id):
+        """ One frame of get_input, uint8 "channels_first" """
+        img = cv2.imread(self.path(frame_id))
+        return cv2.resize(img, (self.width, self.height)).transpose(2, 0, 1)
+
 
-        img = cv2.imread(path)
+    def get_input(self, frame, frame_prev, frame_preprev):
+        """ The 9-channel input of the frames labels.names[frame], [frame_prev] and [frame_preprev]"""
+
+        if self.frame_cache is not None: # the frames shared with the neighbouring samples are decoded once
+            imgs = np.concatenate([self.frame_cache.get(int(f), self.read_frame) for f in (frame, frame_prev, frame_preprev)])
+            return imgs.astype(np.float32) / 255.0
+
+        img = cv2.imread(self.path(frame))
         img = cv2.resize(img, (self.width, self.height))
 
-        img_prev = cv2.imread(path_prev)
+        img_prev = cv2.imread(self.path(frame_prev))
         img_prev = cv2.resize(img_prev, (self.width, self.height))
 
-        img_preprev = cv2.imread(path_preprev)
+        img_preprev = cv2.imread(self.path(frame_preprev))
         img_preprev = cv2.resize(img_preprev, (self.width, self.height))
 
         imgs = np.concatenate((img, img_prev, img_preprev), axis=2)
@@ -93,15 +142,170 @@ class TrackNetDataset(tf.keras.utils.Sequence):
     def generate_binary_heatmap(self, cx, cy, r, mag):
         if cx < 0 or cy < 0:
             return np.zeros((1, self.height, self.width))
-        
-        x, y = np.meshgrid(np.linspace(1, self.width, self.width), np.linspace(1, self.height, self.height))
-        heatmap = ((y - (cy + 1))**2) + ((x - (cx + 1))**2) # ?
-        heatmap[heatmap <= r**2] = 1
-        heatmap[heatmap > r**2] = 0
-        y = heatmap*mag
-        y = np.reshape(y, (1, self.height, self.width))
+        stamper = HeatmapStamper(self.height, self.width, self.height, self.width, kernel=disk_kernel(r))
+        return stamper.stamp(cx, cy, 1).reshape(1, self.height, self.width) * mag
+
+
+def tf_dataset(input_height=360, input_width=640, batch_size=2, frame_store=None, shuffle=True, repeat=True, stamper=None):
+    """ tf.data version of TrackNetDataset. The frames are decoded and resized on the tf.data threads and the next
+    batches are prefetched while the model trains, instead of building every batch in Python between 2 steps.
+    The batches are the same as TrackNetDataset, so it works for the SCCE (TrackNet, U_net) and WBCE (TrackNet2) models.
+    :params
+        input_height, input_width: model resolution
+        batch_size: batch size
+        frame_store: optional FrameStore (see frame_store.py) of the same resolution, to slice the inputs from
+        shuffle: shuffle the samples again every epoch
+        repeat: repeat the samples forever, model.fit then needs steps_per_epoch
+        stamper: optional HeatmapStamper (see labels.py), the heatmaps are then drawn in the graph from the coordinates
+    :return
+        tf.data.Dataset of (inputs (batch, 9, input_height, input_width), outputs (batch, input_height*input_width))
+    """
+    path_dataset = Path(__file__).parent
+    labels = read_labels(os.path.join(path_dataset, 'labels_train.csv'))
+    print(f'#training samples : {len(labels)}')
+    coordinates = labels.coordinates() # NaN if not visible
+
+    if frame_store is not None:
+        store_rows = frame_store.label_rows(labels)
+        rows = np.concatenate([store_rows, store_rows[:, :1]], axis=1) # path, path_prev, path_preprev, path_gt
+        samples = tf.data.Dataset.from_tensor_slices((rows, coordinates))
+
+        def read_sample(rows):
+            # memory map slices, no decoding, the rows are ordered as in FrameStore.get_input
+            def slice_store(rows):
+                imgs = frame_store.frames[rows[:3]].reshape(9, frame_store.height, frame_store.width)
+                return imgs, frame_store.heatmaps[rows[3]]
+            imgs, gt = tf.numpy_function(slice_store, [rows], (tf.uint8, tf.uint8))
+            imgs = tf.cast(imgs, tf.float32) / 255.0
+            return tf.ensure_shape(imgs, (9, input_height, input_width)), gt > 127 # img/255 > 0.5
+    else:
+        # one path per frame of the index, the samples only hold the indexes of their frames
+        frame_paths = tf.constant([os.path.join(path_dataset, labels.frame_path(f)) for f in range(len(labels.names))])
+        gt_paths = tf.constant([] if stamper is not None else
+                               [os.path.join(path_dataset, labels.frame_path(f, 'dataset/gaussian_heatmap'))
+                                for f in range(len(labels.names))], dtype=tf.string)
+        samples = tf.data.Dataset.from_tensor_slices((labels.sample_frames(), coordinates))
+
+        def read(path):
+            img = tf.io.decode_jpeg(tf.io.read_file(path), channels=3, dct_method='INTEGER_ACCURATE') # the pixels of cv2.imread
+            img = tf.image.resize(tf.cast(img, tf.float32), (input_height, input_width)) # bilinear, as cv2.resize
+            return tf.round(img)[:, :, ::-1] # BGR, the channel order of cv2.imread
+
+        def read_sample(frames):
+            path, path_prev, path_preprev = tf.unstack(tf.gather(frame_paths, frames))
+            imgs = tf.concat([read(path), read(path_prev), read(path_preprev)], axis=2) / 255.0
+            imgs = tf.transpose(imgs, (2, 0, 1)) # "channels_first"
+            if stamper is not None: # the heatmap JPEG is not needed
+                return imgs, None
+            return imgs, read(tf.gather(gt_paths, frames[0]))[:, :, 0] / 255 > 0.5 # the same binary heatmap as get_output
+
+    def load(sample, coordinates):
+        imgs, gt = read_sample(sample)
+        if stamper is not None:
+            return imgs, stamper.tf_stamp(coordinates[0], coordinates[1], coordinates[2])
+        return imgs, tf.reshape(tf.cast(gt, tf.float32), (input_height * input_width,))
+
+    if shuffle:
+        samples = samples.shuffle(len(labels), reshuffle_each_iteration=True)
+    if repeat:
+        samples = samples.repeat()
+    return (samples.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+                   .batch(batch_size)
+                   .prefetch(tf.data.AUTOTUNE))
+
+
+def shard_dataset(path_shards, input_height=360, input_width=640, batch_size=2, stamper=None, shuffle=True,
+                  shuffle_buffer=128, cycle_length=2, repeat=True):
+    """ tf.data reader of the shards written by shards.py. The shards are shuffled, cycle_length shards are read
+    sequentially at the same time and their samples go through a shuffle buffer.
+    :params
+        path_shards: directory of the shards
+        input_height, input_width: model resolution, the one the shards were written for
+        batch_size: batch size
+        stamper: HeatmapStamper (see labels.py) of the heatmaps, the binary heatmap of the model resolution by default
+        shuffle: shuffle the shards and the samples again every epoch
+        shuffle_buffer: number of samples to shuffle, each holds its uint8 input
+        cycle_length: number of shards read in parallel
+        repeat: repeat the samples forever, model.fit then needs steps_per_epoch
+    :return
+        tf.data.Dataset of (inputs (batch, 9, input_height, input_width), outputs (batch, input_height*input_width)),
+        like tf_dataset
+    """
+    paths = shard_files(path_shards)
+    if not paths:
+        raise ValueError(f"no shards in {path_shards}, see shards.py")
+    for path in paths:
+        frame_shape = tuple(int(v) for v in np.load(path + '.npz')['frame_shape'])
+        if frame_shape != (3, input_height, input_width):
+            raise ValueError(f"{path} holds frames of {frame_shape[1]}x{frame_shape[2]}, the model input is "
+                             f"{input_height}x{input_width}, write the shards again with shards.py")
+    if stamper is None:
+        stamper = HeatmapStamper(input_height, input_width)
+    signature = (tf.TensorSpec((9, input_height, input_width), tf.uint8), tf.TensorSpec((3,), tf.float32))
+
+    shards = tf.data.Dataset.from_tensor_slices(paths)
+    if shuffle:
+        shards = shards.shuffle(len(paths), reshuffle_each_iteration=True)
+    if repeat:
+        shards = shards.repeat()
+    samples = shards.interleave(lambda path: tf.data.Dataset.from_generator(read_shard, args=(path,), output_signature=signature),
+                                cycle_length=cycle_length, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    if shuffle:
+        samples = samples.shuffle(shuffle_buffer)
+
+    def load(imgs, coordinates):
+        return tf.cast(imgs, tf.float32) / 255.0, stamper.tf_stamp(coordinates[0], coordinates[1], coordinates[2])
+
+    return (samples.map(load, num_parallel_calls=tf.data.AUTOTUNE)
+                   .batch(batch_size)
+                   .prefetch(tf.data.AUTOTUNE))
+
+
+def video_dataset(path_videos, input_height=360, input_width=640, batch_size=2, stamper=None, shuffle=True,
+                  shuffle_buffer=256, cycle_length=4, window=64, repeat=True):
+    """ tf.data reader of labelled match videos (see video_source.py), no JPEGs of the frames are needed.
+    The videos are shuffled, cycle_length videos are decoded at the same time and their samples go through a
+    shuffle buffer, the samples of one window are consecutive frames.
+    :params
+        path_videos: directory of the videos and their labels
+        input_height, input_width: model resolution
+        batch_size: batch size
+        stamper: HeatmapStamper (see labels.py) of the heatmaps, the binary heatmap of the model resolution by default
+        shuffle: shuffle the videos and the samples again every epoch
+        shuffle_buffer: number of samples to shuffle, each holds its uint8 input
+        cycle_length: number of videos decoded in parallel
+        window: number of frames decoded at once per video
+        repeat: repeat the samples forever, model.fit then needs steps_per_epoch
+    :return
+        tf.data.Dataset of (inputs (batch, 9, input_height, input_width), outputs (batch, input_height*input_width)),
+        like tf_dataset
+    """
+    clips = video_clips(path_videos)
+    if not clips:
+        raise ValueError(f"no labelled videos in {path_videos}, every video needs a labels CSV of the same name")
+    print(f'#training videos : {len(clips)}')
+    if stamper is None:
+        stamper = HeatmapStamper(input_height, input_width)
+    # the labels are scaled to the resolution of the stamper, whatever the resolution of the video
+    output_height, output_width = round(input_height / stamper.scale_y), round(input_width / stamper.scale_x)
+    signature = (tf.TensorSpec((9, input_height, input_width), tf.uint8), tf.TensorSpec((3,), tf.float32))
+
+    videos = tf.data.Dataset.from_tensor_slices(([video for video, _ in clips], [labels for _, labels in clips]))
+    if shuffle:
+        videos = videos.shuffle(len(clips), reshuffle_each_iteration=True)
+    if repeat:
+        videos = videos.repeat()
+    samples = videos.interleave(
+        lambda path_video, path_labels: tf.data.Dataset.from_generator(
+            read_video_samples, output_signature=signature,
+            args=(path_video, path_labels, input_height, input_width, output_height, output_width, window)),
+        cycle_length=cycle_length, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    if shuffle:
+        samples = samples.shuffle(shuffle_buffer)
 
-        return y
-    
+    def load(imgs, coordinates):
+        return tf.cast(imgs, tf.float32) / 255.0, stamper.tf_stamp(coordinates[0], coordinates[1], coordinates[2])
 
-    
+    return (samples.map(load, num_parallel_calls=tf.data.AUTOTUNE)
+                   .batch(batch_size)
+                   .prefetch(tf.data.AUTOTUNE))
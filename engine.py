@@ -0,0 +1,198 @@
+## Pipelined inference engine. The stages run concurrently and are connected by bounded queues:
+# decode thread -> preprocess pool -> model thread -> postprocess pool -> outlier removal -> encoder thread (render.py)
+# cv2 and the model release the GIL, so the wall time approaches the slowest stage instead of the sum of all stages.
+
+import threading
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from scipy.spatial import distance
+from utils import model_input_size
+from stream import decode_prediction, remove_outliers_stream, track_online, fill_gaps_stream, record_track, write_track_stream
+
+_END = object() # marks the end of a queue
+
+
+class InferenceEngine:
+    """
+    Run the decode, preprocess, predict, postprocess and encode stages of infer.py concurrently.
+    The queues are bounded (backpressure) and the frames always come out in their original order.
+    """
+    def __init__(self, model, wbce=False, batch_size=1, workers=2, queue_size=16,
+                 height=None, width=None, n_classes=256):
+        self.model = model
+        if height is None or width is None: # the input size the model was built for
+            height, width = model_input_size(model)
+        self.wbce = wbce
+        self.batch_size = batch_size
+        self.workers = workers
+        self.queue_size = queue_size
+        self.height = height
+        self.width = width
+        self.n_classes = n_classes
+        self._batch = np.empty((batch_size, 9, height, width), dtype=np.float32)
+        self._free = None # recycled buffers of the preprocessed frames, see run
+        self._stop = threading.Event() # set when the pipeline fails or the consumer stops reading
+        self._error = None
+        self.detections = []
+
+    def _put(self, q, item, timeout=0.1):
+        """ put on a bounded queue, gives up when the pipeline stops
+        :return
+            False if the item was not put
+        """
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=timeout)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q, timeout=0.1):
+        """ get from a queue, _END when the pipeline stops"""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=timeout)
+            except queue.Empty:
+                pass
+        return _END
+
+    def _preprocess(self, frame):
+        img = self._get(self._free)
+        if img is _END: # stopped
+            return None
+        img[...] = cv2.resize(frame, (self.width, self.height)).transpose(2, 0, 1) # "channel_first"
+        img /= 255.0
+        return img
+
+    def _postprocess(self, prediction, output_height, output_width):
+        return decode_prediction(prediction, self.wbce, self.height, self.width,
+                                 output_height, output_width, self.n_classes)
+
+    def _decode(self, frames, pre_pool, decoded):
+        try:
+            for frame in frames:
+                if not self._put(decoded, (frame, pre_pool.submit(self._preprocess, frame))):
+                    break
+        except BaseException as e:
+            self._error = e
+        finally:
+            if hasattr(frames, 'close'): # e.g. the generator of read_video_stream releases its VideoCapture
+                frames.close()
+            self._put(decoded, _END)
+
+    def _predict(self, decoded, post_pool, predicted):
+        window = deque() # the 3-frame input window
+        pending = [] # frames whose input is waiting in self._batch
+
+        def flush():
+            predictions = self.model.predict_on_batch(self._batch[:len(pending)])
+            for frame, prediction in zip(pending, predictions):
+                output_height, output_width = frame.shape[:2]
+                self._put(predicted, (frame, post_pool.submit(self._postprocess, prediction, output_height, output_width)))
+            pending.clear()
+
+        try:
+            for frame, future in iter(lambda: self._get(decoded), _END):
+                img = future.result()
+                if img is None: # stopped
+                    break
+                window.append(img)
+                if len(window) > 3:
+                    self._free.put(window.popleft())
+                if len(window) < 3:
+                    self._put(predicted, (frame, None))
+                    continue
+                np.concatenate((window[2], window[1], window[0]), out=self._batch[len(pending)]) # combine 3 frames
+                pending.append(frame)
+                if len(pending) == self.batch_size:
+                    flush()
+            if pending: # the last, partial batch
+                flush()
+        except BaseException as e:
+            self._error = e
+            self._stop.set() # the decode thread stops too
+        finally:
+            for img in window:
+                self._free.put(img)
+            self._put(predicted, _END)
+
+    def run(self, frames):
+        """ Run the pipeline on a stream of consecutive frames
+        :params
+            frames: iterable of consecutive video frames, e.g. from read_video_stream, consumed on the decode thread
+                    and closed there, also when the pipeline stops early
+        :return
+            generator of (frame, ball point, euclidean distance to the previous ball point) in frame order
+        """
+        self._error = None
+        self._stop = threading.Event()
+        # Preprocessed frames are written into recycled buffers. At most queue_size + 1 frames wait
+        # for the model thread and the model thread holds 3 frames + the one just received.
+        # New buffers every run, a stopped run may not have returned all of them.
+        self._free = queue.Queue()
+        for _ in range(self.queue_size + 5):
+            self._free.put(np.empty((3, self.height, self.width), dtype=np.float32))
+        decoded = queue.Queue(maxsize=self.queue_size)
+        predicted = queue.Queue(maxsize=self.queue_size)
+        pre_pool = ThreadPoolExecutor(self.workers)
+        post_pool = ThreadPoolExecutor(self.workers)
+        threads = [threading.Thread(target=self._decode, args=(frames, pre_pool, decoded), daemon=True),
+                   threading.Thread(target=self._predict, args=(decoded, post_pool, predicted), daemon=True)]
+        for thread in threads:
+            thread.start()
+
+        prev_ball = (None, None)
+        try:
+            for frame, future in iter(lambda: self._get(predicted), _END):
+                ball = future.result() if future is not None else (None, None)
+                if ball[0] and prev_ball[0]:
+                    dist = distance.euclidean(ball, prev_ball)
+                else:  # If the ball is none, not tracked, set the dist=-1.
+                    dist = -1
+                prev_ball = ball
+                yield frame, ball, dist
+            if self._error is not None:
+                raise self._error
+        finally:
+            # also reached when the consumer closes the generator early: stop the threads, which give up their
+            # blocked puts and gets within the timeout, and empty the queues so nothing holds a frame
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            for q in (decoded, predicted):
+                while not q.empty():
+                    q.get_nowait()
+            pre_pool.shutdown(wait=True, cancel_futures=True)
+            post_pool.shutdown(wait=True, cancel_futures=True)
+
+    def write(self, frames, path_output_video, fps, trace=7, tracker=None, gap_filler=None):
+        """ Run the pipeline, remove the outliers and encode the output video on its own thread
+        :params
+            frames: iterable of consecutive video frames
+            path_output_video: path to output video, None to only track the ball
+            fps: frames per second
+            trace: number of frames with detected trace
+            tracker: optional OnlineTracker used instead of remove_outliers_stream
+            gap_filler: optional GapFiller to interpolate short gaps
+        :return
+            ball_track: list of ball points after removing the outliers, the detections before are kept in self.detections
+        """
+        self.detections = [] # ball points of the model, before the post-processing
+        ball_track = []
+        stream = record_track(self.run(frames), self.detections)
+        if tracker is not None:
+            stream = track_online(stream, tracker)
+        else:
+            stream = remove_outliers_stream(stream)
+        if gap_filler is not None:
+            stream = fill_gaps_stream(stream, gap_filler)
+        if path_output_video is None:
+            for _ in record_track(stream, ball_track):
+                pass
+        else: # encoded on the thread of a TrackRenderer
+            write_track_stream(record_track(stream, ball_track), path_output_video, fps, trace)
+        return ball_track
@@ -0,0 +1,112 @@
+## Export a trained TrackNet, TrackNet2 or U_net checkpoint to a compiled SavedModel with a fixed input signature
+# (batch_size, 9, input_height, input_width), so inference does not re-trace the model on every run.
+# python export.py --saved_model_path models/tracknet.keras --export_path models/tracknet_export --batch_size 2 --serving --xla
+
+import argparse, os
+from pathlib import Path
+import time
+import numpy as np
+import tensorflow as tf
+from keras.models import load_model
+from model import serving_model
+from utils import WBCE_loss
+
+
+class ServingModule(tf.Module):
+    """
+    SavedModel wrapper of a keras model with one compiled, fixed-signature function
+    """
+    def __init__(self, model, batch_size=1, jit_compile=False):
+        super().__init__()
+        self.model = model
+        input_height, input_width = model.input_shape[2], model.input_shape[3]
+        # saved with the model, so the loader knows the signature
+        self.input_size = tf.Variable([batch_size, 9, input_height, input_width], trainable=False, dtype=tf.int32)
+        self.serve = tf.function(lambda frames: self.model(frames, training=False),
+                                 input_signature=[tf.TensorSpec((batch_size, 9, input_height, input_width), tf.float32, name='frames')],
+                                 jit_compile=jit_compile)
+
+
+def export_model(model, export_path, batch_size=1, jit_compile=False):
+    """ Trace the model once with a fixed input signature and save it as a SavedModel
+    :params
+        model: TrackNet, TrackNet2 or U_net model, optionally with the serving head
+        export_path: directory of the exported model
+        batch_size: fixed number of 3-frame inputs per call
+        jit_compile: compile the model with XLA
+    """
+    module = ServingModule(model, batch_size, jit_compile)
+    tf.saved_model.save(module, export_path, signatures={'serving_default': module.serve})
+
+
+class ExportedModel:
+    """
+    Exported model with the predict_on_batch() interface of keras models used by infer.py.
+    Batches smaller than the exported batch size are padded, larger batches are split.
+    """
+    def __init__(self, export_path):
+        self.module = tf.saved_model.load(export_path)
+        self.batch_size, _, self.input_height, self.input_width = [int(v) for v in self.module.input_size.numpy()]
+        self.input_shape = (None, 9, self.input_height, self.input_width)
+        self._padded = np.zeros((self.batch_size, 9, self.input_height, self.input_width), dtype=np.float32)
+
+    def predict_on_batch(self, x):
+        n = len(x)
+        if n > self.batch_size:
+            outputs = [self.predict_on_batch(x[i:i+self.batch_size]) for i in range(0, n, self.batch_size)]
+            return tf.nest.map_structure(lambda *o: np.concatenate(o), *outputs)
+        if n < self.batch_size:
+            self._padded[:n] = x
+            x = self._padded
+        outputs = self.module.serve(tf.constant(x))
+        return tf.nest.map_structure(lambda o: o.numpy()[:n], outputs)
+
+    def warmup(self, steps=2):
+        """ Run the compiled function on zeros, so the first frames do not pay the start up cost"""
+        for _ in range(steps):
+            self.predict_on_batch(np.zeros((self.batch_size, 9, self.input_height, self.input_width), dtype=np.float32))
+
+
+def load_inference_model(path, batch_size=1, serving=False, warmup=True):
+    """ Load an exported model directory or a .keras checkpoint for inference
+    :params
+        path: directory written by export_model, or .keras checkpoint
+        batch_size: batch size used for the warm-up of .keras checkpoints
+        serving: add the serving head to a .keras checkpoint
+        warmup: run the model on zeros before returning it
+    :return
+        model with predict_on_batch()
+    """
+    if os.path.isdir(path):
+        model = ExportedModel(path)
+        if warmup:
+            model.warmup()
+        return model
+
+    model = load_model(path, custom_objects={"WBCE_loss": WBCE_loss}, compile=False)
+    if serving:
+        model = serving_model(model)
+    if warmup:
+        model.predict_on_batch(np.zeros((batch_size,) + tuple(model.input_shape[1:]), dtype=np.float32))
+    return model
+
+
+if __name__ == '__main__':
+    root = Path(__file__).parent
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--saved_model_path', type=str, default = os.path.join(root, 'models/tracknet.keras'), help='path to model')
+    parser.add_argument('--export_path', type=str, default = os.path.join(root, 'models/tracknet_export'), help='directory of the exported model')
+    parser.add_argument('--batch_size', type=int, default=2, help='fixed number of 3-frame inputs per call')
+    parser.add_argument('--serving', default = False, action='store_true', help='decode the heatmap inside the graph, see serving_model in model.py')
+    parser.add_argument('--xla', default = False, action='store_true', help='compile the model with XLA')
+    args = parser.parse_args()
+
+    model = load_model(args.saved_model_path, custom_objects={"WBCE_loss": WBCE_loss}, compile=False)
+    if args.serving:
+        model = serving_model(model)
+    export_model(model, args.export_path, args.batch_size, args.xla)
+
+    start = time.time()
+    exported = ExportedModel(args.export_path)
+    exported.warmup()
+    print("Exported to", args.export_path, ", load and warm-up time:", time.time() - start)
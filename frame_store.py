@@ -0,0 +1,126 @@
+## Frames of the dataset decoded once at model resolution. Every frame is in 3 training inputs, so reading
+# the JPEGs in TrackNetDataset decodes and resizes each frame 3 times per epoch. The store keeps the frames
+# and the ground truth heatmaps as uint8 arrays in .npy files, which are memory mapped when loaded, so
+# building an input is a slice of the page cache.
+# python frame_store.py --input_height 360 --input_width 640   (also run by generate_groundtruth.py)
+
+import argparse, os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import cv2
+from labels import HeatmapStamper
+
+
+def store_path(root, input_height, input_width):
+    """ Default directory of the frame store of one model resolution"""
+    return os.path.join(root, 'dataset', 'frames_{}x{}'.format(input_height, input_width))
+
+
+def frame_key(path):
+    """ (game, clip, file name) of a frame or ground truth path, e.g. dataset/images/game4/Clip6/0052.jpg"""
+    parts = Path(path).parts
+    return parts[-3], parts[-2], parts[-1]
+
+
+def build_frame_store(path_input, path_gt, path_store, input_height=360, input_width=640):
+    """ Decode every labelled frame and its ground truth heatmap once and write them to the store
+    :params
+        path_input: directory of the frames, dataset/images/<game>/<clip>/
+        path_gt: directory of the ground truth heatmaps, dataset/gaussian_heatmap/<game>/<clip>/, None to draw
+            the heatmaps from the coordinates of Label.csv (see labels.py)
+        path_store: output directory
+        input_height, input_width: model resolution
+    """
+    keys = []
+    coordinates = []
+    for game_id in range(1,11): # There are 10 videos in dataset/images, from 1 to 10.
+        game = 'game{}'.format(game_id)
+        for clip in sorted(os.listdir(os.path.join(path_input, game))):
+            labels = pd.read_csv(os.path.join(path_input, game, clip, 'Label.csv'))
+            keys += [(game, clip, name) for name in labels['file name']]
+            coordinates += list(zip(labels['x-coordinate'], labels['y-coordinate'], labels['visibility']))
+
+    os.makedirs(path_store, exist_ok=True)
+    # written through memory maps, the store does not have to fit in memory
+    frames = np.lib.format.open_memmap(os.path.join(path_store, 'frames.npy'), mode='w+', dtype=np.uint8,
+                                       shape=(len(keys), 3, input_height, input_width))
+    heatmaps = np.lib.format.open_memmap(os.path.join(path_store, 'heatmaps.npy'), mode='w+', dtype=np.uint8,
+                                         shape=(len(keys), input_height, input_width))
+    stampers = {} # Gaussian kernels per frame size
+    for row, (game, clip, name) in enumerate(keys):
+        img = cv2.imread(os.path.join(path_input, game, clip, name))
+        frames[row] = cv2.resize(img, (input_width, input_height)).transpose(2, 0, 1) # "channels_first"
+        if path_gt is None:
+            if img.shape[:2] not in stampers:
+                stampers[img.shape[:2]] = HeatmapStamper(input_height, input_width, *img.shape[:2], binary=False)
+            heatmap = stampers[img.shape[:2]].stamp(*coordinates[row]).reshape(input_height, input_width)
+            heatmaps[row] = np.round(heatmap * 255)
+        else:
+            gt = cv2.imread(os.path.join(path_gt, game, clip, name))
+            heatmaps[row] = cv2.resize(gt, (input_width, input_height))[:, :, 0]
+        if row % 1000 == 0:
+            print('frame store: {}/{}'.format(row, len(keys)))
+    frames.flush()
+    heatmaps.flush()
+    games, clips, names = zip(*keys) if keys else ((), (), ())
+    np.savez(os.path.join(path_store, 'index.npz'), game=np.array(games), clip=np.array(clips), name=np.array(names))
+
+
+class FrameStore:
+    """
+    Read-only memory-mapped frames and heatmaps written by build_frame_store
+    """
+    def __init__(self, path_store):
+        self.frames = np.load(os.path.join(path_store, 'frames.npy'), mmap_mode='r')
+        self.heatmaps = np.load(os.path.join(path_store, 'heatmaps.npy'), mmap_mode='r')
+        self.height, self.width = self.frames.shape[2:]
+        index = np.load(os.path.join(path_store, 'index.npz'))
+        self.rows = {key: row for row, key in enumerate(zip(index['game'], index['clip'], index['name']))}
+
+    def row(self, path):
+        return self.rows[frame_key(path)]
+
+    def label_rows(self, labels):
+        """ Rows of the frames of every sample of a label index, without building their paths
+        :params
+            labels: LabelIndex (see label_index.py)
+        :return
+            int64 (N, 3) rows of (frame, prev, preprev), the ground truth heatmap of a sample is in the row of its frame
+        """
+        # one lookup per frame of the index, the samples are gathered from it
+        clip_of_frame = np.repeat(np.arange(len(labels.clip_start)), np.diff(np.append(labels.clip_start, len(labels.names))))
+        frame_rows = np.array([self.rows[(labels.games[c], labels.clips[c], name)]
+                               for c, name in zip(clip_of_frame, labels.names)], dtype=np.int64)
+        return frame_rows[labels.sample_frames()]
+
+    def input_at(self, rows):
+        """ The 9-channel input of utils.get_input of the frames in rows (frame, prev, preprev)"""
+        imgs = self.frames[rows].reshape(9, self.height, self.width).astype(np.float32)
+        imgs /= 255.0
+        return imgs
+
+    def output_at(self, row):
+        """ The flattened binary heatmap of utils.get_output of the frame in row"""
+        img = self.heatmaps[row] > 127 # img/255 > 0.5
+        return img.astype('float32').reshape(self.width * self.height)
+
+    def get_input(self, path, path_prev, path_preprev):
+        """ The 9-channel input of utils.get_input, sliced from the store"""
+        return self.input_at([self.row(path), self.row(path_prev), self.row(path_preprev)])
+
+    def get_output(self, path_gt):
+        """ The flattened binary heatmap of utils.get_output, sliced from the store"""
+        return self.output_at(self.row(path_gt))
+
+
+if __name__ == '__main__':
+    root = Path(__file__).parent
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_height', type=int, default=360)
+    parser.add_argument('--input_width', type=int, default=640)
+    parser.add_argument('--stamp_labels', action='store_true', help='draw the heatmaps from the label coordinates instead of reading dataset/gaussian_heatmap')
+    args = parser.parse_args()
+
+    build_frame_store(os.path.join(root, 'dataset/images'), None if args.stamp_labels else os.path.join(root, 'dataset/gaussian_heatmap'),
+                      store_path(root, args.input_height, args.input_width), args.input_height, args.input_width)
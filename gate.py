@@ -0,0 +1,89 @@
+## Cheap pre-filter in front of the model. TrackNet is trained on full court views only, so frames of crowd shots,
+# close-ups or replays, and frames where nothing moves, are skipped before the forward pass. Every test works on a
+# small downsampled copy of the already decoded frame.
+
+import numpy as np
+import cv2
+
+INFER = 'infer'
+STATIC = 'static' # nothing moves since the previous frame
+NOT_COURT = 'not_court' # no large area of court colour
+CUT = 'cut' # first frames of a new shot, the 3-frame input still holds frames of the previous shot
+
+
+class SceneGate:
+    """
+    Mark every frame as INFER, or as skipped with the reason (STATIC, NOT_COURT, CUT)
+    """
+    def __init__(self, width=160, height=90, pixel_threshold=20, min_motion=1, cut_threshold=0.5,
+                 min_court=0.3, hue_bins=18):
+        """
+        :params
+            width, height: size of the downsampled frames
+            pixel_threshold: minimum grey level difference of a moving pixel
+            min_motion: minimum number of moving pixels to run the model, the ball alone is 1 or 2 downsampled pixels
+            cut_threshold: minimum Bhattacharyya distance between the colour histograms of two frames of a scene cut
+            min_court: minimum fraction of the frame covered by the dominant colour (the court) in a court view
+            hue_bins: number of hue bins of the colour histogram
+        """
+        self.width = width
+        self.height = height
+        self.pixel_threshold = pixel_threshold
+        self.min_motion = min_motion
+        self.cut_threshold = cut_threshold
+        self.min_court = min_court
+        self.hue_bins = hue_bins
+        self.reset()
+
+    def reset(self):
+        """ Forget the previous frames and the counters"""
+        self.prev_gray = None
+        self.prev_hist = None
+        self.since_cut = 2 # number of frames since the last scene cut
+        self.num = -1 # index of the last frame
+        self.cuts = set() # indexes of the first frame of every new shot
+        self.counters = {INFER: 0, STATIC: 0, NOT_COURT: 0, CUT: 0}
+
+    def check(self, frame):
+        """ Decide whether the model runs on the next frame
+        :params
+            frame: BGR video frame
+        :return
+            INFER, STATIC, NOT_COURT or CUT
+        """
+        self.num += 1
+        small = cv2.resize(frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1], None, [self.hue_bins, 8], [0, 180, 0, 256])
+        cv2.normalize(hist, hist, 1, 0, cv2.NORM_L1)
+        prev_gray, prev_hist = self.prev_gray, self.prev_hist
+        self.prev_gray, self.prev_hist = gray, hist
+
+        if self.num < 2: # the first frames of the video have no model input either
+            return CUT
+        if cv2.compareHist(prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > self.cut_threshold:
+            self.cuts.add(self.num)
+            self.since_cut = 0
+        else:
+            self.since_cut += 1
+        if self.since_cut < 2: # the 3-frame input spans the cut
+            return self._count(CUT)
+
+        # the court is the largest area of one saturated colour
+        hue = hist[:, 1:].sum(axis=1) # without the grey pixels
+        if hue.max() < self.min_court:
+            return self._count(NOT_COURT)
+
+        motion = np.count_nonzero(cv2.absdiff(gray, prev_gray) > self.pixel_threshold)
+        if motion < self.min_motion:
+            return self._count(STATIC)
+        return self._count(INFER)
+
+    def _count(self, decision):
+        self.counters[decision] += 1
+        return decision
+
+    def skipped(self):
+        """ Number of forward passes avoided"""
+        return sum(self.counters.values()) - self.counters[INFER]
@@ -6,7 +6,15 @@ import pandas as pd
 import os
 import cv2
 import argparse
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from frame_store import build_frame_store, store_path
+from label_index import COLUMNS, index_path, save_label_index, read_labels
+from shards import write_shards, shards_path
+
+STAMP_FILE = '.gt_stamp.json' # parameters of the heatmaps of a clip, see create_gt_clip
 
 
 def gaussian_kernel(size, variance):
@@ -22,65 +30,104 @@ def create_gaussian(size, variance):
     return gaussian_kernel_array
 
 
-def create_gt_images(path_input, path_output, size, variance, width, height):
+def clip_stamp(path_labels, size, variance, width, height):
+    """ Everything a clip of heatmaps depends on, its Label.csv and the kernel parameters"""
+    with open(path_labels, 'rb') as f:
+        labels_hash = hashlib.md5(f.read()).hexdigest()
+    return {'labels': labels_hash, 'size': size, 'variance': variance, 'width': width, 'height': height}
+
+
+def create_gt_clip(path_clip, path_out_clip, size, variance, width, height, force=False):
+    """ Create the heatmaps of one clip, unless they are up to date with its Label.csv and the kernel parameters
+    :return
+        True if the heatmaps were written, False if the clip was skipped
+    """
+    path_labels = os.path.join(path_clip, 'Label.csv')
+    path_stamp = os.path.join(path_out_clip, STAMP_FILE)
+    stamp = clip_stamp(path_labels, size, variance, width, height)
+    labels = pd.read_csv(path_labels)
+    if not force and os.path.exists(path_stamp):
+        with open(path_stamp) as f:
+            if json.load(f) == stamp and all(os.path.exists(os.path.join(path_out_clip, name)) for name in labels['file name']):
+                return False
+
+    os.makedirs(path_out_clip, exist_ok=True)
+    kernel = np.clip(create_gaussian(size, variance), 0, 255).astype(np.uint8).T # heatmap[y+j, x+i] = kernel[i][j]
+    kernel = np.repeat(kernel[:, :, None], 3, axis=2) # (temp,temp,temp)
+    heatmap = np.zeros((height, width, 3), dtype=np.uint8)
+    for file_name, vis, x, y in zip(labels['file name'], labels['visibility'], labels['x-coordinate'], labels['y-coordinate']):
+        heatmap[...] = 0
+        if vis != 0:
+            x = int(x)
+            y = int(y)
+            x0, x1 = max(x - size, 0), min(x + size + 1, width)
+            y0, y1 = max(y - size, 0), min(y + size + 1, height)
+            if x0 < x1 and y0 < y1: # clipped at the borders of the frame
+                heatmap[y0:y1, x0:x1] = kernel[y0 - y + size:y1 - y + size, x0 - x + size:x1 - x + size]
+        cv2.imwrite(os.path.join(path_out_clip, file_name), heatmap)
+    # written last, an interrupted clip is created again on the next run
+    with open(path_stamp, 'w') as f:
+        json.dump(stamp, f)
+    return True
+
+
+def create_gt_images(path_input, path_output, size, variance, width, height, workers=None, force=False):
     """ Create the data for training and heatmap
+    The clips are spread over a process pool and only the clips whose Label.csv or kernel parameters changed are created again.
+    :params
+        workers: number of processes, os.cpu_count() by default
+        force: create all the clips again
     """
-    gaussian_kernel_array = create_gaussian(size, variance)
-    for game_id in range(1,11): # There are 10 videos in dataset/images, from 1 to 10.
-        game = 'game{}'.format(game_id)
-        clips = os.listdir(os.path.join(path_input, game))
-        for clip in clips:
-            print('game = {}, clip = {}'.format(game, clip))
-
-            path_out_game = os.path.join(path_output, game)
-            if not os.path.exists(path_out_game):
-                os.makedirs(path_out_game)
-
-            path_out_clip = os.path.join(path_out_game, clip)    
-            if not os.path.exists(path_out_clip):
-                os.makedirs(path_out_clip)  
-
-            path_labels = os.path.join(os.path.join(path_input, game, clip), 'Label.csv')
-            labels = pd.read_csv(path_labels)    
-            for idx in range(labels.shape[0]):
-                file_name, vis, x, y, _ = labels.loc[idx, :]
-                heatmap = np.zeros((height, width, 3), dtype=np.uint8)
-                if vis != 0:
-                    x = int(x)
-                    y = int(y)
-                    for i in range(-size, size+1):
-                        for j in range(-size, size+1):
-                                if x+i<width and x+i>=0 and y+j<height and y+j>=0 :
-                                    temp = gaussian_kernel_array[i+size][j+size]
-                                    if temp > 0:
-                                        heatmap[y+j,x+i] = (temp,temp,temp)
-
-                cv2.imwrite(os.path.join(path_out_clip, file_name), heatmap) 
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {}
+        for game_id in range(1,11): # There are 10 videos in dataset/images, from 1 to 10.
+            game = 'game{}'.format(game_id)
+            for clip in sorted(os.listdir(os.path.join(path_input, game))):
+                futures[pool.submit(create_gt_clip, os.path.join(path_input, game, clip),
+                                    os.path.join(path_output, game, clip), size, variance, width, height, force)] = (game, clip)
+        for future in as_completed(futures):
+            game, clip = futures[future]
+            print('game = {}, clip = {}: {}'.format(game, clip, 'created' if future.result() else 'up to date'))
 
 
 def create_gt_labels(root, path_input, path_output, train_rate=0.7):
     """To split the dataset into training data(70%) and test data(30%)
+    Writes labels_train.csv and labels_val.csv, and their binary indexes (see label_index.py)
     """
-    df = pd.DataFrame()
+    games, clips, names, clip_start = [], [], [], []
+    targets = []
     for game_id in range(1,11):
         game = 'game{}'.format(game_id)
-        clips = os.listdir(os.path.join(path_input, game))
-        for clip in clips:
+        for clip in os.listdir(os.path.join(path_input, game)):
             labels = pd.read_csv(os.path.join(path_input, game, clip, 'Label.csv'))
+            clip_start.append(len(names))
+            games.append(game)
+            clips.append(clip)
+            names += list(labels['file name'])
+            labels['clip_id'] = len(clips) - 1
+            labels['frame_idx'] = np.arange(len(labels))
             labels['gt_path'] = 'dataset/gaussian_heatmap/' + game + '/' + clip + '/' + labels['file name']
             labels['path1'] = 'dataset/images/' + game + '/' + clip + '/' + labels['file name']
-            labels_target = labels[2:]
-            labels_target.loc[:, 'path2'] = list(labels['path1'][1:-1])
-            labels_target.loc[:, 'path3'] = list(labels['path1'][:-2])
-            df = pd.concat([df,labels_target])
-    df = df.reset_index(drop=True) 
-    df = df[['path1', 'path2', 'path3', 'gt_path', 'x-coordinate', 'y-coordinate', 'status', 'visibility']]
+            labels_target = labels[2:].copy()
+            labels_target['path2'] = labels['path1'].values[1:-1]
+            labels_target['path3'] = labels['path1'].values[:-2]
+            targets.append(labels_target)
+    df = pd.concat(targets, ignore_index=True) # once, concatenating in the loop copies the whole table per clip
     df = df.sample(frac=1)
     num_train = int(df.shape[0]*train_rate)
-    df_train = df[:num_train]
-    df_test = df[num_train:]
-    df_train.to_csv(os.path.join(root, 'labels_train.csv'), index=False)
-    df_test.to_csv(os.path.join(root, 'labels_val.csv'), index=False)  
+    for part, file_name in ((df[:num_train], 'labels_train.csv'), (df[num_train:], 'labels_val.csv')):
+        path_csv = os.path.join(root, file_name)
+        part[COLUMNS].to_csv(path_csv, index=False)
+        coordinates = part[['x-coordinate', 'y-coordinate']].fillna(0).values
+        if (coordinates != np.round(coordinates)).any(): # the index only holds integer pixels, read_labels reads the CSV
+            print(f'{file_name}: sub-pixel coordinates, no binary index')
+            if os.path.exists(index_path(path_csv)):
+                os.remove(index_path(path_csv))
+            continue
+        rows = np.stack([part['clip_id'], part['frame_idx'],
+                         part['x-coordinate'].fillna(-1), part['y-coordinate'].fillna(-1),
+                         part['visibility'], part['status'].fillna(-1)], axis=1)
+        save_label_index(index_path(path_csv), games, clips, names, clip_start, rows)
 
 
 if __name__ == '__main__':
@@ -89,6 +136,15 @@ if __name__ == '__main__':
     VARIANCE = 10
     WIDTH = 1280
     HEIGHT = 720   
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--no_heatmap_images', action='store_true', help='do not write dataset/gaussian_heatmap, for training with --stamp_labels')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes creating the heatmaps, all cores by default')
+    parser.add_argument('--frame_store', action='store_true', help='also decode every frame once at model resolution, see frame_store.py')
+    parser.add_argument('--shards', action='store_true', help='also pack the training samples into shards for sequential reading, see shards.py')
+    parser.add_argument('--input_height', type=int, default=360, help='model resolution of the frame store and the shards')
+    parser.add_argument('--input_width', type=int, default=640)
+    parser.add_argument('--force', action='store_true', help='create all the heatmaps again, also the clips that are up to date')
+    args = parser.parse_args()
     root = Path(__file__).parent
     path_input = os.path.join(root, 'dataset/images')
     path_output = os.path.join(root, 'dataset/gaussian_heatmap')
@@ -96,5 +152,12 @@ if __name__ == '__main__':
     if not os.path.exists(path_output):
         os.makedirs(path_output)
 
-    create_gt_images(path_input, path_output, SIZE, VARIANCE, WIDTH, HEIGHT)
+    if not args.no_heatmap_images:
+        create_gt_images(path_input, path_output, SIZE, VARIANCE, WIDTH, HEIGHT, args.workers, args.force)
     create_gt_labels(root,path_input, path_output)
+    if args.frame_store: # for TrackNetDataset and validation
+        build_frame_store(path_input, None if args.no_heatmap_images else path_output,
+                          store_path(root, args.input_height, args.input_width), args.input_height, args.input_width)
+    if args.shards:
+        write_shards(read_labels(os.path.join(root, 'labels_train.csv')), root,
+                     shards_path(root, args.input_height, args.input_width), args.input_height, args.input_width)
@@ -1,23 +1,39 @@
-from utils import heatMap
+from utils import model_input_size
+from preprocess import FrameRing
+from track import track_from_list, track_to_list, remove_outliers_array, split_track_array, interpolate_track, OnlineTracker, GapFiller
+from track import make_track_file, save_track
+from stream import decode_prediction, remove_outliers_stream, track_online, fill_gaps_stream, record_track, write_track_stream
 from tqdm import tqdm
 import numpy as np
 import argparse,cv2,os
-from itertools import groupby
 from scipy.spatial import distance
-from keras.models import load_model
+from export import load_inference_model
+from render import TrackRenderer
+from gate import SceneGate, INFER
 from pathlib import Path
+from contextlib import closing, nullcontext
 import time
 
+def video_fps(cap, path_video):
+    """ Frame rate of an opened video as a float, 29.97 stays 29.97 so the timestamps of the track file stay exact"""
+    if not cap.isOpened():
+        raise ValueError(f"can not open the video {path_video}")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not fps > 0: # also NaN
+        cap.release()
+        raise ValueError(f"the video {path_video} reports {fps} frames per second, the timestamps can not be computed")
+    return fps
+
 def read_video(path_video):
     """ Read video file    
     :params
         path_video: path to video file
     :return
         frames: list of video frames
-        fps: frames per second
+        fps: frames per second, float
     """
     cap = cv2.VideoCapture(path_video)
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    fps = video_fps(cap, path_video)
 
     frames = []
     while cap.isOpened():
@@ -29,78 +45,125 @@ def read_video(path_video):
     cap.release()
     return frames, fps
 
-def infer_model(frames, model):
+def read_video_stream(path_video):
+    """ Read video file lazily, one frame at a time
+    :params
+        path_video: path to video file
+    :return
+        frames: generator of video frames, only the current frame is kept alive
+        fps: frames per second, float
+    """
+    cap = cv2.VideoCapture(path_video)
+    fps = video_fps(cap, path_video)
+
+    def frames():
+        try:
+            while cap.isOpened():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield frame
+        finally:
+            cap.release()
+    return frames(), fps
+
+def infer_stream(frames, model, wbce=False, batch_size=1, gate=None, confs=None):
+    """ Run pretrained model on a stream of consecutive frames.
+    Only the 3-frame input windows of the current batch are kept alive, so the memory
+    does not depend on the length of the video. Each frame is resized and scaled once.
+    :params
+        frames: iterable of consecutive video frames (list or generator)
+        model: pretrained model
+        wbce: True for TrackNet2(U-Net+Sigmoid) + WBCE-loss models, use heatMap_1 to decode.
+              Serving models (see serving_model in model.py) are decoded by heatMap_peak.
+        batch_size: number of consecutive 3-frame inputs predicted in one forward pass
+        gate: optional SceneGate, the frames it does not pass get no ball point without running the model
+        confs: optional list, the confidence of every frame (the heatmap peak, 0 without prediction) is appended to it
+    :return
+        generator of (frame, ball point, euclidean distance to the previous ball point)
+    """
+    height, width = model_input_size(model) # the input size the model was built for
+    n_classes = 256
+    ring = FrameRing(height, width) # each frame is preprocessed once, for the 3 inputs it appears in
+    batch = np.empty((batch_size, 9, height, width), dtype=np.float32)
+    pending = [] # frames whose 3-frame input is waiting in batch for the next forward pass
+    prev_ball = (None, None)
+
+    def predict_pending():
+        nonlocal prev_ball
+        predictions = model.predict_on_batch(batch[:len(pending)])
+        for frame, prediction in zip(pending, predictions):
+            output_height, output_width = frame.shape[:2]
+            if confs is not None:
+                *ball, score = decode_prediction(prediction, wbce, height, width, output_height, output_width,
+                                                 n_classes, with_score=True)
+                ball = tuple(ball)
+                confs.append(score)
+            else:
+                ball = decode_prediction(prediction, wbce, height, width, output_height, output_width, n_classes)
+
+            if ball[0] and prev_ball[0]:
+                dist = distance.euclidean(ball, prev_ball)
+            else:  # If the ball is none, not tracked, set the dist=-1.
+                dist = -1
+            prev_ball = ball
+            yield frame, ball, dist
+        pending.clear()
+
+    for frame in frames:
+        ring.push(frame)
+        skip = gate is not None and gate.check(frame) != INFER
+        if not ring.ready() or skip:
+            if pending: # keep the frame order
+                yield from predict_pending()
+            prev_ball = (None, None)
+            if confs is not None:
+                confs.append(0.0)
+            yield frame, (None, None), -1
+            continue
+        ring.triplet(out=batch[len(pending)]) # combine 3 frames, "channel_first" as TrackNet expects
+        pending.append(frame)
+        if len(pending) == batch_size:
+            yield from predict_pending()
+    if pending: # the last, partial batch
+        yield from predict_pending()
+
+def infer_model(frames, model, batch_size=1, confs=None):
     """ Run pretrained model on a consecutive list of frames    
     :params
-        frames: list of consecutive video frames
+        frames: list or generator of consecutive video frames
         model: pretrained model
+        batch_size: number of consecutive 3-frame inputs predicted in one forward pass
+        confs: optional list, the confidence of every frame is appended to it, see infer_stream
     :return    
         ball_track: list of detected ball points
         dists: list of euclidean distances between two neighbouring ball points
     """
-    height = 360
-    width = 640
-    n_classes = 256
-    # ratio = frames[2].shape[0] / height
-    dists = [-1]*2
-    ball_track = [(None,None)]*2
-    output_height = frames[2].shape[0]
-    output_width = frames[2].shape[1]
-    for num in tqdm(range(2, len(frames))):
-        img = cv2.resize(frames[num], (width, height))
-        img_prev = cv2.resize(frames[num-1], (width, height))
-        img_preprev = cv2.resize(frames[num-2], (width, height))
-        imgs = np.concatenate((img, img_prev, img_preprev), axis=2) # combine 3 frames
-        imgs = imgs.astype(np.float32)/255.0
-        imgs = np.rollaxis(imgs, 2, 0) # Since the order of TrackNet is "channel_first", the axis need to change.
-        prediction = model.predict(np.array([imgs]),verbose=0)[0]
-        
-        x_pred,y_pred=heatMap(prediction, n_classes, height, width, output_height, output_width)
-        ball_track.append((x_pred, y_pred))
-
-        if ball_track[-1][0] and ball_track[-2][0]:
-            dist = distance.euclidean(ball_track[-1], ball_track[-2])
-        else:  # If the ball is none, not tracked, set the dist=-1.
-            dist = -1
-        dists.append(dist)  
+    ball_track = []
+    dists = []
+    total = len(frames) if hasattr(frames, '__len__') else None
+    for _, ball, dist in tqdm(infer_stream(frames, model, batch_size=batch_size, confs=confs), total=total):
+        ball_track.append(ball)
+        dists.append(dist)
     return ball_track, dists 
 
-def infer_model_1(frames, model): # TrackNet2(U-Net+Sigmoid) + WBCE-loss
+def infer_model_1(frames, model, batch_size=1, confs=None): # TrackNet2(U-Net+Sigmoid) + WBCE-loss
     """ Run pretrained model on a consecutive list of frames    
     :params
-        frames: list of consecutive video frames
+        frames: list or generator of consecutive video frames
         model: pretrained model
+        batch_size: number of consecutive 3-frame inputs predicted in one forward pass
+        confs: optional list, the confidence of every frame is appended to it, see infer_stream
     :return    
         ball_track: list of detected ball points
         dists: list of euclidean distances between two neighbouring ball points
     """
     start_time = time.time()
-    height = 360
-    width = 640
-    n_classes = 256
-    # ratio = frames[2].shape[0] / height
-    dists = [-1]*2
-    ball_track = [(None,None)]*2
-    output_height = frames[0].shape[0]
-    output_width = frames[0].shape[1]
-    for num in range(2, len(frames)):
-        img = cv2.resize(frames[num], (width, height))
-        img_prev = cv2.resize(frames[num-1], (width, height))
-        img_preprev = cv2.resize(frames[num-2], (width, height))
-        imgs = np.concatenate((img, img_prev, img_preprev), axis=2) # combine 3 frames
-        imgs = imgs.astype(np.float32)/255.0
-        imgs = np.rollaxis(imgs, 2, 0) # Since the order of TrackNet is "channel_first", the axis need to change.
-        prediction = model.predict(np.array([imgs]),verbose=0)[0]
-        
-        x_pred,y_pred = heatMap_1(prediction, height, width, output_height, output_width)
-        # x_pred,y_pred = binary_heatMap(prediction, height, width, output_height, output_width, ratio=2) # Not suitable for tennis ball tracking
-        ball_track.append((x_pred, y_pred))
-
-        if ball_track[-1][0] and ball_track[-2][0]:
-            dist = distance.euclidean(ball_track[-1], ball_track[-2])
-        else:
-            dist = -1
-        dists.append(dist)  
+    ball_track = []
+    dists = []
+    for _, ball, dist in infer_stream(frames, model, wbce=True, batch_size=batch_size, confs=confs):
+        ball_track.append(ball)
+        dists.append(dist)
     run_time = time.time() - start_time
     print( "The infer_model_1 running time is ", run_time)
     return ball_track, dists 
@@ -114,15 +177,9 @@ def remove_outliers(ball_track, dists, max_dist = 100):
     :return
         ball_track: list of ball points
     """
-    outliers = list(np.where(np.array(dists) > max_dist)[0])
-    for i in outliers:
-        if i+1>=len(dists):
-            break
-        if (dists[i+1] > max_dist) | (dists[i+1] == -1):       
-            ball_track[i] = (None, None)
-            outliers.remove(i)
-        elif dists[i-1] == -1:
-            ball_track[i-1] = (None, None)
+    track = remove_outliers_array(track_from_list(ball_track), dists, max_dist)
+    for i in np.flatnonzero(~track['valid']):
+        ball_track[i] = (None, None)
     return ball_track  
 
 def split_track(ball_track, max_gap=4, max_dist_gap=80, min_track=5):
@@ -136,23 +193,7 @@ def split_track(ball_track, max_gap=4, max_dist_gap=80, min_track=5):
     :return
         result: list of subtrack indexes    
     """
-    list_det = [0 if x[0] else 1 for x in ball_track]
-    groups = [(k, sum(1 for _ in g)) for k, g in groupby(list_det)]
-
-    cursor = 0
-    min_value = 0
-    result = []
-    for i, (k, l) in enumerate(groups):
-        if (k == 1) & (i > 0) & (i < len(groups) - 1):
-            dist = distance.euclidean(ball_track[cursor-1], ball_track[cursor+l])
-            if (l >=max_gap) | (dist/l > max_dist_gap):
-                if cursor - min_value > min_track:
-                    result.append([min_value, cursor])
-                    min_value = cursor + l - 1        
-        cursor += l
-    if len(list_det) - min_value > min_track: 
-        result.append([min_value, len(list_det)]) 
-    return result    
+    return split_track_array(track_from_list(ball_track), max_gap, max_dist_gap, min_track)
 
 def interpolation(coords):
     """ Run ball interpolation in one subtrack    
@@ -161,22 +202,11 @@ def interpolation(coords):
     :return
         track: list of interpolated ball coordinates of one subtrack
     """
-    def nan_helper(y):
-        return np.isnan(y), lambda z: z.nonzero()[0]
-
-    x = np.array([x[0] if x[0] is not None else np.nan for x in coords])
-    y = np.array([x[1] if x[1] is not None else np.nan for x in coords])
-
-    nons, yy = nan_helper(x)
-    x[nons]= np.interp(yy(nons), yy(~nons), x[~nons])
-    nans, xx = nan_helper(y)
-    y[nans]= np.interp(xx(nans), xx(~nans), y[~nans])
-
-    track = [*zip(x,y)]
-    return track
+    track = interpolate_track(track_from_list(coords))
+    return [*zip(track['x'], track['y'])]
 
 def write_track(frames, ball_track, path_output_video, fps, trace=7):
-    """ Write .avi file with detected ball tracks
+    """ Write .mp4 file with detected ball tracks
     :params
         frames: list of original video frames
         ball_track: list of ball coordinates
@@ -184,49 +214,125 @@ def write_track(frames, ball_track, path_output_video, fps, trace=7):
         fps: frames per second
         trace: number of frames with detected trace
     """
-    height, width = frames[0].shape[:2]
-    # out = cv2.VideoWriter(path_output_video, cv2.VideoWriter_fourcc(*'DIVX'), 
-    out = cv2.VideoWriter(path_output_video, cv2.VideoWriter_fourcc(*'mp4v'),                      
-                          fps, (width, height))
-    for num in range(len(frames)):
-        frame = frames[num]
-        for i in range(trace):
-            if (num-i > 0):
-                if ball_track[num-i][0]:
-                    x = int(ball_track[num-i][0])
-                    y = int(ball_track[num-i][1])
-                    frame = cv2.circle(frame, (x,y), radius=0, color = (0, 225, 165) , thickness=10-i)
-                else:
-                    break
-        out.write(frame) 
-    print("lllllllllllllllllllllllllllll")
-    out.release()    
+    write_track_stream(zip(frames, ball_track), path_output_video, fps, trace)
+
+def positive_int(value):
+    """ argparse type of the counts that must be at least 1, e.g. --batch_size"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 if __name__ == '__main__':
     root = Path(__file__).parent
     parser = argparse.ArgumentParser()
-    parser.add_argument('--batch_size', type=int, default=2, help='batch size')
-    parser.add_argument('--saved_model_path', type=str, default = os.path.join(root, 'models/tracknet.keras'), help='path to model')
+    parser.add_argument('--batch_size', type=positive_int, default=2, help='number of consecutive 3-frame inputs predicted in one forward pass')
+    parser.add_argument('--saved_model_path', type=str, default = os.path.join(root, 'models/tracknet.keras'), help='path to .keras model or exported model directory')
     parser.add_argument('--input_video_path', type=str, help='path to input video')
     parser.add_argument('--output_video_path', type=str, help='path to output video')
     parser.add_argument('--extrapolation', default = False, action='store_true', help='whether to use ball track extrapolation')
+    parser.add_argument('--stream', default = False, action='store_true', help='decode, infer and write frame by frame with constant memory')
+    parser.add_argument('--pipeline', default = False, action='store_true', help='stream with decode, preprocess, predict, postprocess and encode running concurrently')
+    parser.add_argument('--serving', default = False, action='store_true', help='decode the heatmap inside the graph, the model only returns (x, y, confidence)')
+    parser.add_argument('--roi', default = False, action='store_true', help='stream and run the model on a crop around the predicted ball once it is found')
+    parser.add_argument('--online', default = False, action='store_true', help='stream and use a Kalman filter to reject outliers and fill short gaps without delay')
+    parser.add_argument('--workers', type=positive_int, default=2, help='number of preprocess and postprocess threads of --pipeline')
+    parser.add_argument('--gate', default = False, action='store_true', help='stream and skip the model on static frames, scene cuts and frames without a court view')
+    parser.add_argument('--stride', type=int, default=1, help='stream and run the model on every stride-th frame only, fast events are still refined frame by frame')
+    parser.add_argument('--compare_dense', default = False, action='store_true', help='with --stride, also run the model on every frame and print the F1 of the strided track')
+    parser.add_argument('--output_track_path', type=str, help='path to output track file (.npy), see load_track in track.py')
+    parser.add_argument('--no_render', '--no-render', default = False, action='store_true', help='only track the ball, do not encode the output video')
     args = parser.parse_args()
+    if args.online and not (args.stream or args.pipeline or args.roi):
+        args.stream = True # the online tracker works frame by frame
+    if args.roi and os.path.isdir(args.saved_model_path):
+        parser.error('--roi needs a .keras model, exported models have a fixed input size')
+    if args.stride > 1 and (args.roi or args.pipeline):
+        parser.error('--stride can not be used with --roi or --pipeline')
+    if args.gate and (args.roi or args.pipeline or args.stride > 1):
+        parser.error('--gate can not be used with --roi, --pipeline or --stride')
+    if args.stride > 1 or args.gate:
+        args.stream = True
     
-    model = load_model(args.saved_model_path)
-    frames, fps = read_video(args.input_video_path)
-    ball_track, dists = infer_model(frames, model)
-    ball_track = remove_outliers(ball_track, dists)    
-    
-    if args.extrapolation:
-        subtracks = split_track(ball_track)
-        for r in subtracks:
-            ball_subtrack = ball_track[r[0]:r[1]]
-            ball_subtrack = interpolation(ball_subtrack)
-            ball_track[r[0]:r[1]] = ball_subtrack
+    model = load_inference_model(args.saved_model_path, args.batch_size, serving=args.serving)
+    wbce = False # as infer_model: TrackNet and U_net trained with SCCE, infer_model_1 is the TrackNet2 (WBCE) path
+    output_video_path = None if args.no_render else args.output_video_path
+    if args.pipeline:
+        from engine import InferenceEngine
+        frames, fps = read_video_stream(args.input_video_path)
+        engine = InferenceEngine(model, wbce, batch_size=args.batch_size, workers=args.workers)
+        with closing(frames): # tqdm does not close the frames it wraps
+            ball_track = engine.write(tqdm(frames), output_video_path, fps, tracker=OnlineTracker() if args.online else None,
+                                      gap_filler=GapFiller() if args.extrapolation else None)
+        detections = engine.detections
+        confs = None
+    elif args.stream or args.roi:
+        frames, fps = read_video_stream(args.input_video_path)
+        # confidence of the tracker with --online, else of the model, only kept for the track file
+        confs = [] if args.output_track_path else None
+        if args.roi:
+            from roi import RoiTracker
+            tracker = RoiTracker(model, wbce)
+            stream = tracker.run(frames)
+            confs = confs if args.online else None # RoiTracker gives no confidence
+        elif args.stride > 1:
+            from stride import StridedTracker
+            tracker = StridedTracker(model, wbce, stride=args.stride)
+            stream = tracker.run(frames)
+            confs = confs if args.online else None # StridedTracker gives no confidence
+        else:
+            scene_gate = SceneGate() if args.gate else None
+            stream = infer_stream(frames, model, wbce, batch_size=args.batch_size, gate=scene_gate,
+                                  confs=None if args.online else confs)
+        cuts = scene_gate.cuts if args.gate else None
+        detections = []
+        stream = record_track(tqdm(stream), detections, detected_only=True)
+        if args.online:
+            stream = track_online(stream, OnlineTracker(), cuts, confs)
+        else:
+            stream = remove_outliers_stream(stream)
+        if args.extrapolation: # incremental interpolation with a bounded delay
+            stream = fill_gaps_stream(stream, GapFiller(), cuts)
+        ball_track = []
+        with TrackRenderer(output_video_path, fps) if output_video_path else nullcontext() as renderer:
+            for frame, ball, _ in record_track(stream, ball_track):
+                if renderer is not None:
+                    renderer.put(frame, ball)
+        if args.roi:
+            print("full frame passes:", tracker.full_passes, ", crop passes:", tracker.roi_passes)
+        if args.gate:
+            print("gate:", scene_gate.counters, ", forward passes avoided:", scene_gate.skipped(), ", scene cuts:", len(scene_gate.cuts))
+        if args.stride > 1:
+            print("model calls:", tracker.model_calls, ", frames predicted:", tracker.frames_predicted,
+                  ", frames interpolated:", tracker.frames_interpolated, ", intervals refined:", tracker.intervals_refined)
+            if args.compare_dense:
+                from accuracy import track_f1
+                frames, _ = read_video_stream(args.input_video_path)
+                dense_track = []
+                stream = remove_outliers_stream(infer_stream(frames, model, wbce, batch_size=args.batch_size))
+                for _ in record_track(stream, dense_track):
+                    pass
+                precision, recall, f1 = track_f1(ball_track, dense_track)
+                print(f"against the dense track: precision {precision:.4f}, recall {recall:.4f}, f1 {f1:.4f}")
+    else:
+        # the frames are not kept, the renderer decodes the input video again once the track is complete
+        frames, fps = read_video_stream(args.input_video_path)
+        confs = [] if args.output_track_path else None
+        detections, dists = infer_model(frames, model, args.batch_size, confs)
+        track = remove_outliers_array(track_from_list(detections), dists)
         
-    write_track(frames, ball_track, args.output_video_path, fps)    
-    
-    
-    
-    
-    
+        if args.extrapolation:
+            subtracks = split_track_array(track)
+            for r in subtracks:
+                interpolate_track(track, r[0], r[1])
+
+        ball_track = track_to_list(track)
+        if output_video_path:
+            with TrackRenderer(output_video_path, fps, source_video=args.input_video_path) as renderer:
+                for ball in ball_track:
+                    renderer.put(None, ball)
+
+    if args.output_track_path:
+        save_track(args.output_track_path, make_track_file(detections, ball_track, fps, confs))
+    print("frames:", len(ball_track), ", tracked:", sum(ball[0] is not None for ball in ball_track))
+
@@ -0,0 +1,145 @@
+## Binary index of labels_train.csv and labels_val.csv. Every sample of the CSV repeats 4 long paths; the index keeps
+# a table of the clips and the file names of their frames once, and one row of integers per sample:
+# (clip_id, frame_idx, x, y, visibility, status). The 3 frames of a sample are frame_idx, frame_idx-1 and frame_idx-2
+# of its clip. np.load of the index is much faster than parsing the CSV. The coordinates are integer pixels, as in
+# Label.csv; x, y and status are -1 where the CSV has NaN, so to_frame gives back the values of the CSV.
+# The readers (TrackNetDataset, tf_dataset, FrameStore, the validation) use the arrays directly, a frame is named by
+# its index in names, and the path of a frame is only built when its JPEG is read.
+
+import os
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+COLUMNS = ['path1', 'path2', 'path3', 'gt_path', 'x-coordinate', 'y-coordinate', 'status', 'visibility'] # of the CSV
+ROW_FIELDS = ['clip_id', 'frame_idx', 'x', 'y', 'visibility', 'status']
+
+
+def index_path(path_csv):
+    """ Path of the index of a labels CSV, labels_train.csv -> labels_train.npz"""
+    return os.path.splitext(path_csv)[0] + '.npz'
+
+
+def save_label_index(path, games, clips, names, clip_start, rows):
+    """ Write the index
+    :params
+        games, clips: game and clip directory of every clip_id
+        names: file names of the frames of all clips, the frames of clip c start at clip_start[c]
+        clip_start: index in names of the first frame of every clip
+        rows: int32 array (N, 6) of ROW_FIELDS, x and y are -1 if the ball is not visible, status is -1 if unknown (NaN)
+    """
+    np.savez(path, game=np.array(games), clip=np.array(clips), name=np.array(names),
+             clip_start=np.array(clip_start, dtype=np.int64), rows=np.asarray(rows, dtype=np.int32))
+
+
+class LabelIndex:
+    """
+    Samples of a labels CSV as arrays, see read_labels
+    """
+    def __init__(self, games, clips, names, clip_start, rows, xy=None):
+        """
+        :params
+            games, clips, names, clip_start, rows: see save_label_index
+            xy: optional (N, 2) ball coordinates of the CSV, NaN if not visible, for sub-pixel labels;
+                by default the x and y of rows
+        """
+        self.games = np.asarray(games)
+        self.clips = np.asarray(clips)
+        self.names = np.asarray(names)
+        self.clip_start = np.asarray(clip_start, dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=np.int32)
+        if xy is None:
+            xy = np.where(self.rows[:, 2:4] < 0, np.nan, self.rows[:, 2:4])
+        self.xy = np.asarray(xy, dtype=np.float64)
+        # index in names of the frame of every sample, its previous frames are frame_ids - 1 and frame_ids - 2
+        self.frame_ids = self.clip_start[self.rows[:, 0]] + self.rows[:, 1]
+
+    @classmethod
+    def load(cls, path):
+        """ Read an index written by save_label_index"""
+        index = np.load(path)
+        return cls(index['game'], index['clip'], index['name'], index['clip_start'], index['rows'])
+
+    @classmethod
+    def from_csv(cls, path_csv):
+        """ Parse a labels CSV, the frames of every clip are the ones its samples use, in file name order"""
+        data = pd.read_csv(path_csv)
+        keys = [[Path(path).parts[-3:] for path in data[column]] for column in ['path1', 'path2', 'path3']]
+        frames = {} # (game, clip) -> file names
+        for key in set(key for column in keys for key in column):
+            frames.setdefault(key[:2], []).append(key[2])
+        games, clips, names, clip_start, clip_ids, name_ids = [], [], [], [], {}, {}
+        for game, clip in sorted(frames):
+            clip_ids[game, clip] = len(games)
+            games.append(game)
+            clips.append(clip)
+            clip_start.append(len(names))
+            for name in sorted(frames[game, clip]):
+                name_ids[game, clip, name] = len(names)
+                names.append(name)
+        frame_ids = np.array([[name_ids[key] for key in column] for column in keys], dtype=np.int64)
+        if not ((frame_ids[1] == frame_ids[0] - 1) & (frame_ids[2] == frame_ids[0] - 2)).all():
+            raise ValueError(f"{path_csv}: path2 and path3 are not the 2 frames before path1")
+        clip_id = np.array([clip_ids[key[:2]] for key in keys[0]], dtype=np.int64)
+        xy = data[['x-coordinate', 'y-coordinate']].to_numpy(np.float64)
+        rows = np.stack([clip_id, frame_ids[0] - np.array(clip_start)[clip_id],
+                         np.nan_to_num(xy[:, 0], nan=-1), np.nan_to_num(xy[:, 1], nan=-1),
+                         data['visibility'].values, data['status'].fillna(-1).values], axis=1)
+        return cls(games, clips, names, clip_start, rows, xy)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def clip_ids(self):
+        return self.rows[:, 0]
+
+    @property
+    def visibility(self):
+        return self.rows[:, 4]
+
+    def coordinates(self):
+        """ float32 (N, 3) x, y, visibility of every sample, x and y are NaN if the ball is not visible, as in tf_stamp"""
+        return np.concatenate([self.xy, self.visibility[:, None]], axis=1).astype(np.float32)
+
+    def sample_frames(self):
+        """ int64 (N, 3) indexes in names of the frames of every sample (frame, prev, preprev), as path1, path2, path3"""
+        return self.frame_ids[:, None] - np.arange(3)
+
+    def frame_path(self, frame_id, directory='dataset/images'):
+        """ Path of a frame, relative to the root of the repository
+        :params
+            frame_id: index in names
+            directory: dataset/images, or dataset/gaussian_heatmap for its ground truth heatmap
+        """
+        c = np.searchsorted(self.clip_start, frame_id, side='right') - 1
+        return '/'.join([directory, str(self.games[c]), str(self.clips[c]), str(self.names[frame_id])])
+
+    def to_frame(self):
+        """ The samples as the DataFrame of pd.read_csv on the CSV"""
+        clip_id, frame_idx, x, y, visibility, status = self.rows.T
+        clip_dirs = [game + '/' + clip + '/' for game, clip in zip(self.games, self.clips)]
+        dirs = [clip_dirs[c] for c in clip_id]
+        names = [self.names[self.frame_ids - k] for k in range(3)]
+        return pd.DataFrame({
+            'path1': ['dataset/images/' + d + n for d, n in zip(dirs, names[0])],
+            'path2': ['dataset/images/' + d + n for d, n in zip(dirs, names[1])],
+            'path3': ['dataset/images/' + d + n for d, n in zip(dirs, names[2])],
+            'gt_path': ['dataset/gaussian_heatmap/' + d + n for d, n in zip(dirs, names[0])],
+            'x-coordinate': self.xy[:, 0], # NaN as in the CSV
+            'y-coordinate': self.xy[:, 1],
+            'status': np.where(status < 0, np.nan, status) if (status < 0).any() else status, # int without NaN
+            'visibility': visibility,
+        }, columns=COLUMNS)
+
+
+def read_labels(path_csv):
+    """ Read labels_train.csv or labels_val.csv, from its index when the index is at least as new as the CSV
+    :return
+        LabelIndex
+    """
+    path_index = index_path(path_csv)
+    if os.path.exists(path_index) and (not os.path.exists(path_csv) or
+                                       os.path.getmtime(path_index) >= os.path.getmtime(path_csv)):
+        return LabelIndex.load(path_index)
+    return LabelIndex.from_csv(path_csv)
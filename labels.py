@@ -0,0 +1,103 @@
+## Ground truth heatmaps drawn from the ball coordinates of the labels. The heatmap JPEGs of dataset/gaussian_heatmap
+# only hold the Gaussian of generate_groundtruth.py around (x-coordinate, y-coordinate), so the same mask is made by
+# copying a kernel, computed once at model resolution, into a zero buffer. No heatmap JPEG is read or decoded.
+
+import math
+import numpy as np
+import tensorflow as tf
+
+
+def label_kernel(size=20, variance=10, scale_x=0.5, scale_y=0.5, binary=True):
+    """ The create_gaussian kernel of generate_groundtruth.py, sampled at model resolution
+    :params
+        size, variance: SIZE and VARIANCE of generate_groundtruth.py, in pixels of the original frames
+        scale_x, scale_y: model resolution / original resolution
+        binary: threshold the kernel at 0.5 like get_output, else the Gaussian in [0, 1]
+    :return
+        float32 kernel of shape (2*radius_y + 1, 2*radius_x + 1)
+    """
+    radius_y, radius_x = math.ceil(size * scale_y), math.ceil(size * scale_x)
+    y, x = np.mgrid[-radius_y:radius_y+1, -radius_x:radius_x+1]
+    kernel = np.exp(-((x / scale_x)**2 + (y / scale_y)**2) / float(2*variance))
+    kernel = (kernel * 255).astype(int) # the uint8 levels of the heatmap JPEGs
+    if binary:
+        return (kernel > 127).astype(np.float32) # img/255 > 0.5
+    return (kernel / 255).astype(np.float32)
+
+
+def disk_kernel(radius):
+    """ Disk of ones, the mask of generate_binary_heatmap"""
+    y, x = np.mgrid[-radius:radius+1, -radius:radius+1]
+    return (x**2 + y**2 <= radius**2).astype(np.float32)
+
+
+class HeatmapStamper:
+    """
+    Draw the flattened ground truth heatmap of a sample from its ball coordinates
+    """
+    def __init__(self, input_height=360, input_width=640, output_height=720, output_width=1280,
+                 size=20, variance=10, binary=True, kernel=None):
+        """
+        :params
+            input_height, input_width: model resolution
+            output_height, output_width: resolution of the labelled frames
+            size, variance, binary: kernel of label_kernel
+            kernel: optional kernel at model resolution used instead, e.g. disk_kernel(5)
+        """
+        self.height = input_height
+        self.width = input_width
+        self.scale_x = input_width / output_width
+        self.scale_y = input_height / output_height
+        if kernel is None:
+            kernel = label_kernel(size, variance, self.scale_x, self.scale_y, binary)
+        self.kernel = kernel
+        self.radius_y, self.radius_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+
+    def center(self, x, y):
+        """ Model pixel of the ball point (x, y) of the original frame"""
+        # pixel centres as in cv2.resize
+        return math.floor((x + 0.5) * self.scale_x), math.floor((y + 0.5) * self.scale_y)
+
+    def stamp(self, x, y, vis, out=None):
+        """ Heatmap of one sample
+        :params
+            x, y: ball point in the original frame, ignored when the ball is not visible
+            vis: visibility of the label, 0 if the ball is not in the frame
+            out: optional float32 buffer of input_height*input_width values to draw into
+        :return
+            flattened heatmap, like get_output
+        """
+        if out is None:
+            out = np.empty(self.height * self.width, dtype=np.float32)
+        heatmap = out.reshape(self.height, self.width)
+        heatmap[...] = 0
+        if float(vis) == 0:
+            return out
+        cx, cy = self.center(float(x), float(y))
+        x0, x1 = max(cx - self.radius_x, 0), min(cx + self.radius_x + 1, self.width)
+        y0, y1 = max(cy - self.radius_y, 0), min(cy + self.radius_y + 1, self.height)
+        if x0 < x1 and y0 < y1: # clipped at the borders of the frame
+            heatmap[y0:y1, x0:x1] = self.kernel[y0 - cy + self.radius_y:y1 - cy + self.radius_y,
+                                                x0 - cx + self.radius_x:x1 - cx + self.radius_x]
+        return out
+
+    def tf_stamp(self, x, y, vis):
+        """ stamp() inside a tf.data graph, x and y are NaN when the ball is not visible"""
+        visible = tf.logical_and(tf.not_equal(vis, 0), tf.logical_not(tf.math.is_nan(x)))
+        x = tf.where(visible, x, 0.0)
+        y = tf.where(visible, y, 0.0)
+        # The kernel is padded into a canvas that reaches margin = 2*radius + 1 pixels beyond every border of the
+        # frame, and the frame is cropped out of it, so the part of the kernel outside the frame is dropped like in
+        # stamp(). A centre further out than radius + 1 pixels draws nothing whatever its value, it is only limited
+        # so the padding stays non-negative.
+        margin_y, margin_x = 2*self.radius_y + 1, 2*self.radius_x + 1
+        cx = tf.cast(tf.clip_by_value(tf.floor((x + 0.5) * self.scale_x),
+                                      -self.radius_x - 1, self.width + self.radius_x), tf.int32)
+        cy = tf.cast(tf.clip_by_value(tf.floor((y + 0.5) * self.scale_y),
+                                      -self.radius_y - 1, self.height + self.radius_y), tf.int32)
+        top, left = cy - self.radius_y + margin_y, cx - self.radius_x + margin_x # of the kernel in the canvas
+        heatmap = tf.pad(tf.constant(self.kernel), [[top, self.height + margin_y - 1 - cy - self.radius_y],
+                                                    [left, self.width + margin_x - 1 - cx - self.radius_x]])
+        heatmap = heatmap[margin_y:margin_y + self.height, margin_x:margin_x + self.width]
+        heatmap = heatmap * tf.cast(visible, tf.float32)
+        return tf.reshape(heatmap, (self.height * self.width,))
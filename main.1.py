@@ -2,33 +2,44 @@
 
 from pathlib import Path
 import tensorflow as tf
-from infer import infer_model, write_track, read_video, remove_outliers,infer_model_1
-from keras.models import load_model
+from infer import infer_model, read_video_stream, remove_outliers,infer_model_1, positive_int
+from render import TrackRenderer
+from track import make_track_file, save_track
+from export import load_inference_model
 import argparse,cv2,os
 from utils import WBCE_loss
 
 if __name__ == '__main__':
     root = Path(__file__).parent
     parser = argparse.ArgumentParser()
-    parser.add_argument('--batch_size', type=int, default=2, help='batch size')
-    parser.add_argument('--saved_model_path', type=str, default = os.path.join(root, 'models/tracknet2wb.4.keras'), help= 'path to model')
+    parser.add_argument('--batch_size', type=positive_int, default=2, help='number of consecutive 3-frame inputs predicted in one forward pass')
+    parser.add_argument('--saved_model_path', type=str, default = os.path.join(root, 'models/tracknet2wb.4.keras'), help= 'path to .keras model or exported model directory')
     parser.add_argument('--input_video_path', type=str, help='path to input video')
     parser.add_argument('--output_video_path', type=str, help='path to output video')
+    parser.add_argument('--output_track_path', type=str, help='path to output track file (.npy), see load_track in track.py')
+    parser.add_argument('--no_render', '--no-render', default = False, action='store_true', help='only compute the recall, do not encode the output video')
     args = parser.parse_args()
 
     video_path = "media/D-S_24AO.mp4"
 
-    model = load_model(args.saved_model_path, custom_objects={"WBCE_loss": WBCE_loss}) # WBCE_loss is the customized loss function
+    model = load_inference_model(args.saved_model_path, args.batch_size) # WBCE_loss is the customized loss function
     
-    frames, fps = read_video(video_path)
+    frames, fps = read_video_stream(video_path) # the frames are not kept, the renderer decodes the video again
 
-    print("total frames:", len(frames))
+    confs = [] if args.output_track_path else None # only kept for the track file
+    balls, dists = infer_model_1(frames, model, args.batch_size, confs) # For WBCE_loss 
     
-    balls, dists = infer_model_1(frames, model) # For WBCE_loss 
+    print("total frames:", len(balls))
     
+    detections = list(balls) # remove_outliers works in place
     balls = remove_outliers(balls, dists)    
+    if args.output_track_path:
+        save_track(args.output_track_path, make_track_file(detections, balls, fps, confs))
     output_path = "media/output.mp4"
-    write_track(frames, balls, output_path, fps)    
+    if not args.no_render:
+        with TrackRenderer(output_path, fps, source_video=video_path) as renderer:
+            for ball in balls:
+                renderer.put(None, ball)
 
     n = len(balls)
     tracked_balls = []
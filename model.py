@@ -5,14 +5,33 @@ from keras.layers import *
 from keras.activations import *
 from keras import ops
 import tensorflow as tf
+import keras
+import numpy as np
 import cv2
+from utils import WBCE_loss
+
+def pad_input(imgs_input, input_height, input_width, multiple=8):
+	"""" Zero pad the bottom and the right of the input, so the 3 MaxPooling2D layers divide its size,
+	e.g. 180x320 -> 184x320. The pixel coordinates do not change. Returns the padded input and the padding.
+	"""
+	padding = (-input_height % multiple, -input_width % multiple)
+	if padding == (0, 0):
+		return imgs_input, padding
+	return ZeroPadding2D(((0, padding[0]), (0, padding[1])), data_format='channels_first')(imgs_input), padding
+
+def crop_padding(x, padding):
+	"""" Remove the padding of pad_input from the output, so the heatmap has the size of the input"""
+	if padding == (0, 0):
+		return x
+	return Cropping2D(((0, padding[0]), (0, padding[1])), data_format='channels_first')(x)
 
 def TrackNet(n_classes, input_height, input_width): # input_height = 360, input_width = 640
 
 	imgs_input = Input(shape=(9,input_height,input_width))
+	padded, padding = pad_input(imgs_input, input_height, input_width)
 
 	#layer1
-	x = Conv2D(64, (3, 3), kernel_initializer='random_uniform', padding='same', data_format='channels_first' )(imgs_input)
+	x = Conv2D(64, (3, 3), kernel_initializer='random_uniform', padding='same', data_format='channels_first' )(padded)
 	x = ( Activation('relu'))(x)
 	x = ( BatchNormalization())(x)
 
@@ -119,6 +138,7 @@ def TrackNet(n_classes, input_height, input_width): # input_height = 360, input_
 	x = ( Activation('relu'))(x)
 	x = ( BatchNormalization())(x)
 
+	x = crop_padding(x, padding)
 	out_shape = Model(imgs_input , x ).output_shape
 	#layer24 output shape: 256, 360, 640
 
@@ -145,9 +165,10 @@ def TrackNet(n_classes, input_height, input_width): # input_height = 360, input_
 def TrackNet2( input_height, input_width ): # Originally input_height = 360, input_width = 640
         
 	imgs_input = Input(shape=(9,input_height,input_width))
+	padded, padding = pad_input(imgs_input, input_height, input_width)
 
 	#Layer1
-	x = Conv2D(64, (3, 3), kernel_initializer='random_uniform', padding='same', data_format='channels_first' )(imgs_input)
+	x = Conv2D(64, (3, 3), kernel_initializer='random_uniform', padding='same', data_format='channels_first' )(padded)
 	x = ( Activation('relu'))(x)
 	x = ( BatchNormalization())(x)
 
@@ -258,6 +279,7 @@ def TrackNet2( input_height, input_width ): # Originally input_height = 360, inp
 	x = ( Activation('sigmoid'))(x)
 	print ("layer24 x.shape:",x.shape)
 	
+	x = crop_padding(x, padding)
 	o_shape = Model(imgs_input , x ).output_shape
 
 	filters = o_shape[1]
@@ -285,10 +307,11 @@ def U_net(n_classes, input_height, input_width):
 	"""" Build the TrackNet model bu U-net architecture, but the final layer is softmax()
 	"""
 	imgs_input = Input(shape=(9,input_height,input_width))
+	padded, padding = pad_input(imgs_input, input_height, input_width)
 
 	# Contracting path
 	#layer1
-	x = Conv2D(64, (3, 3), kernel_initializer='random_uniform', padding='same', data_format='channels_first' )(imgs_input)
+	x = Conv2D(64, (3, 3), kernel_initializer='random_uniform', padding='same', data_format='channels_first' )(padded)
 	x = ( Activation('relu'))(x)
 	x = ( BatchNormalization())(x)
 
@@ -403,6 +426,7 @@ def U_net(n_classes, input_height, input_width):
 
         
 
+	x = crop_padding(x, padding)
 	o_shape = Model(imgs_input , x ).output_shape
 
 	OutputHeight = o_shape[2]
@@ -429,8 +453,86 @@ def U_net(n_classes, input_height, input_width):
 	return model
 
 
-
-	
-
-
-
+@keras.saving.register_keras_serializable(package='TrackNet')
+class HeatmapPeak(Layer):
+	"""" Decode the heatmap inside the graph, so the model returns (x, y, confidence) per frame
+	instead of the (360*640, n_classes) probabilities. x and y are in model input pixels, the centroid of
+	the binary heatmap around its densest pixel, confidence is the fraction of the pool_size window filled.
+	"""
+	def __init__(self, input_height, input_width, wbce=False, pool_size=5, centroid_size=19, **kwargs):
+		super().__init__(**kwargs)
+		self.input_height = input_height
+		self.input_width = input_width
+		self.wbce = wbce
+		self.pool_size = pool_size
+		self.centroid_size = centroid_size
+
+	def call(self, x):
+		if self.wbce:
+			# TrackNet2(sigmoid) + WBCE_loss, the same threshold as heatMap_1
+			mask = ops.cast(x > 0.5, 'float32')
+		else:
+			# softmax + SCCE, the same threshold as heatMap on the argmax class
+			mask = ops.cast(ops.argmax(x, axis=-1) > 127, 'float32')
+		mask = ops.reshape(mask, (-1, self.input_height, self.input_width, 1))
+
+		# the ball is the densest blob of the binary heatmap
+		density = ops.average_pool(mask, self.pool_size, strides=1, padding='same', data_format='channels_last')
+		density = ops.reshape(density, (-1, self.input_height*self.input_width))
+		peak = ops.argmax(density, axis=1)
+		confidence = ops.max(density, axis=1)
+
+		# its centre is the centroid of the mask in the centroid_size window around the peak, like the circle
+		# centre of HoughCircles. argmax alone gives the first pixel of a plateau, up to pool_size // 2 pixels from
+		# the centre, so the window covers a blob of radius 7 around any pixel of the plateau
+		ys, xs = np.mgrid[0:self.input_height, 0:self.input_width].astype(np.float32)
+		moments = ops.concatenate([mask, mask * xs[None, :, :, None], mask * ys[None, :, :, None]], axis=-1)
+		moments = ops.average_pool(moments, self.centroid_size, strides=1, padding='same', data_format='channels_last')
+		moments = ops.reshape(moments, (-1, self.input_height*self.input_width, 3))
+		moments = ops.take_along_axis(moments, ops.reshape(peak, (-1, 1, 1)), axis=1)[:, 0]
+		area = ops.maximum(moments[:, 0], 1e-6)
+		return ops.stack([moments[:, 1] / area, moments[:, 2] / area, confidence], axis=1)
+
+	def get_config(self):
+		config = super().get_config()
+		config.update({'input_height': self.input_height, 'input_width': self.input_width,
+		               'wbce': self.wbce, 'pool_size': self.pool_size, 'centroid_size': self.centroid_size})
+		return config
+
+
+def serving_model(model):
+	"""" Add the HeatmapPeak serving head to a TrackNet, TrackNet2 or U_net model"""
+	input_height, input_width = model.input_shape[2], model.input_shape[3]
+	wbce = model.output_shape[-1] == 1 # TrackNet2 has one sigmoid channel, TrackNet and U_net have n_classes
+	peak = HeatmapPeak(input_height, input_width, wbce=wbce, name='heatmap_peak')(model.output)
+	return Model(model.input, peak)
+
+
+def load_serving_model(path):
+	"""" Load an existing .keras checkpoint and add the serving head"""
+	model = load_model(path, custom_objects={"WBCE_loss": WBCE_loss}, compile=False)
+	return serving_model(model)
+
+
+def resize_model(model, input_height, input_width):
+	"""" Build the same TrackNet, TrackNet2 or U_net (optionally with the serving head) for another
+	input size and copy the weights, the convolutions do not depend on the input size.
+	Input sizes which are not multiples of 8 are padded, see pad_input.
+	The width can not change: BatchNormalization() normalizes the last axis, which is the width
+	for "channels_first" inputs, so its weights have one value per column.
+	"""
+	if (-input_width % 8) + input_width != (-model.input_shape[3] % 8) + model.input_shape[3]:
+		raise ValueError(f"resize_model can not change the (padded) width {model.input_shape[3]} of the model")
+	serving = any(isinstance(layer, HeatmapPeak) for layer in model.layers)
+	heatmap_shape = model.get_layer('heatmap_peak').input.shape if serving else model.output_shape
+	n_classes = heatmap_shape[-1]
+	if n_classes == 1:
+		resized = TrackNet2(input_height, input_width)
+	elif any(isinstance(layer, Concatenate) for layer in model.layers):
+		resized = U_net(n_classes, input_height, input_width)
+	else:
+		resized = TrackNet(n_classes, input_height, input_width)
+	resized.set_weights(model.get_weights())
+	if serving:
+		resized = serving_model(resized)
+	return resized
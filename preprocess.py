@@ -0,0 +1,64 @@
+## Preprocessing of the 3-frame model input.
+# Every decoded frame is resized, cast to float32 and moved to "channels_first" exactly once,
+# the 9-channel input of TrackNet is then copied out of a small ring of preprocessed frames.
+
+import numpy as np
+import cv2
+
+
+class FrameRing:
+    """
+    Ring buffer of preprocessed frames, stored "channels_first" as (3, height, width) float32
+    """
+    def __init__(self, height=360, width=640, size=3, divisor=255.0):
+        self.height = height
+        self.width = width
+        self.size = size
+        self.divisor = divisor
+        self.buffer = np.empty((size, 3, height, width), dtype=np.float32)
+        self._resized = np.empty((height, width, 3), dtype=np.uint8)
+        self.count = 0 # number of frames pushed so far
+
+    def push(self, frame):
+        """ Resize, scale and transpose one decoded frame into the next slot
+        :params
+            frame: BGR frame of any size
+        :return
+            slot: index of the slot holding the frame
+        """
+        slot = self.count % self.size
+        if frame.shape[:2] == (self.height, self.width):
+            resized = frame
+        else:
+            resized = cv2.resize(frame, (self.width, self.height), dst=self._resized)
+        out = self.buffer[slot]
+        out[...] = resized.transpose(2, 0, 1)
+        out /= self.divisor
+        self.count += 1
+        return slot
+
+    def ready(self):
+        """ True when the ring holds at least 3 consecutive frames"""
+        return self.count >= 3
+
+    def triplet(self, out=None, num=None, crop=None):
+        """ Build the 9-channel input (frame, previous frame, pre-previous frame) with a single copy
+        :params
+            out: optional preallocated (9, height, width) float32 array to write into
+            num: index of the current frame, default is the last pushed frame
+            crop: optional (y0, x0, crop_height, crop_width) region of the frames to take
+        :return
+            out: the 9-channel input
+        """
+        if num is None:
+            num = self.count - 1
+        buffer = self.buffer
+        if crop is not None:
+            y0, x0, crop_height, crop_width = crop
+            buffer = buffer[:, :, y0:y0+crop_height, x0:x0+crop_width]
+        height, width = buffer.shape[2:]
+        if out is None:
+            out = np.empty((9, height, width), dtype=np.float32)
+        slots = [num % self.size, (num-1) % self.size, (num-2) % self.size]
+        np.take(buffer, slots, axis=0, out=out.reshape(3, 3, height, width))
+        return out
@@ -0,0 +1,114 @@
+## Streaming renderer of the ball track. The frames are drawn and encoded on a background thread fed by a bounded
+# queue, so encoding overlaps inference and no frame list is kept in memory. With source_video the renderer
+# decodes the input video again by itself, so the caller only sends the ball points and can drop its frames.
+
+import threading
+import queue
+from collections import deque
+import cv2
+
+_END = object() # marks the end of the queue
+
+
+def draw_trace(frame, recent):
+    """ Draw the ball trace on a frame, in place
+    :params
+        frame: video frame
+        recent: ball points of the last frames, recent[0] is the ball point of this frame
+    :return
+        frame
+    """
+    for i, (x, y) in enumerate(recent):
+        if x:
+            frame = cv2.circle(frame, (int(x),int(y)), radius=0, color = (0, 225, 165) , thickness=10-i)
+        else:
+            break
+    return frame
+
+
+class TrackRenderer:
+    """
+    Draw the ball trace and encode the output video on a background thread
+    """
+    def __init__(self, path_output_video, fps, trace=7, source_video=None, queue_size=16):
+        """
+        :params
+            path_output_video: path to output video
+            fps: frames per second
+            trace: number of frames with detected trace
+            source_video: path to the input video, the frames are then decoded by the renderer and put() only needs the ball points
+            queue_size: maximum number of frames waiting for the encoder, put() blocks when it is full
+        """
+        self.path_output_video = path_output_video
+        self.fps = fps
+        self.trace = trace
+        self.source_video = source_video
+        self.frames_written = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._encode, daemon=True)
+        self._thread.start()
+
+    def _source_frames(self):
+        cap = cv2.VideoCapture(self.source_video)
+        try:
+            while cap.isOpened():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield frame
+        finally:
+            cap.release()
+
+    def _encode(self):
+        out = None
+        recent = deque(maxlen=self.trace) # recent[i] is the ball point of i frames ago
+        source = self._source_frames() if self.source_video is not None else None
+        try:
+            for num, (frame, ball) in enumerate(iter(self._queue.get, _END)):
+                if self._error is not None: # drop the frames after an error, close() raises it
+                    continue
+                try:
+                    if source is not None:
+                        frame = next(source, None)
+                        if frame is None: # the track is longer than the video
+                            continue
+                    if out is None:
+                        height, width = frame.shape[:2]
+                        out = cv2.VideoWriter(self.path_output_video, cv2.VideoWriter_fourcc(*'mp4v'),
+                                              self.fps, (width, height))
+                    recent.appendleft(ball if num > 0 else (None, None))
+                    out.write(draw_trace(frame, recent))
+                    self.frames_written += 1
+                except BaseException as e:
+                    self._error = e
+        finally:
+            if out is not None:
+                out.release()
+            if source is not None:
+                source.close()
+
+    def put(self, frame, ball):
+        """ Queue the next frame
+        :params
+            frame: video frame, or None when the renderer reads the source video
+            ball: ball point of the frame, (None, None) if not tracked
+        """
+        self._queue.put((frame, ball))
+
+    def close(self):
+        """ Wait until all queued frames are encoded"""
+        self._queue.put(_END)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except BaseException:
+            if exc_type is None: # an error of the encoder does not replace the error of the with block
+                raise
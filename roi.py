@@ -0,0 +1,118 @@
+## Region-of-interest tracking. Once the ball is found, the next position is almost always within ~100 px
+# of the last one (the same bound as remove_outliers and BallDetector.threshold_dist), so the model only runs
+# on a band of rows around the predicted position. It falls back to the full frame when the ball is lost and
+# periodically to re-acquire it. The band keeps the full width: the BatchNormalization layers of the models
+# normalize over the last (width) axis, so their weights only fit inputs of the trained width.
+
+import numpy as np
+from scipy.spatial import distance
+from preprocess import FrameRing
+from stream import decode_prediction
+from model import resize_model
+from utils import model_input_size
+
+
+class RoiTracker:
+    """
+    Run TrackNet on a crop around the ball predicted from the recent track
+    """
+    def __init__(self, model, wbce=False, crop_height=128, crop_width=None, reacquire=50,
+                 height=None, width=None, n_classes=256):
+        """
+        :params
+            model: pretrained keras model for the full frame (height, width)
+            wbce: True for TrackNet2(U-Net+Sigmoid) + WBCE-loss models
+            crop_height, crop_width: size of the crop in model pixels, crop_width must be the width of the model
+            reacquire: run the full frame at least every reacquire frames
+            height, width: input size of the model, read from the model by default
+        """
+        if height is None or width is None:
+            height, width = model_input_size(model)
+        if crop_width is None:
+            crop_width = width
+        self.model = model
+        self.roi_model = resize_model(model, crop_height, crop_width) # same weights, smaller input
+        self.wbce = wbce
+        self.crop_height = crop_height
+        self.crop_width = crop_width
+        self.reacquire = reacquire
+        self.height = height
+        self.width = width
+        self.n_classes = n_classes
+        self.full_input = np.empty((1, 9, height, width), dtype=np.float32)
+        self.roi_input = np.empty((1, 9, crop_height, crop_width), dtype=np.float32)
+        self.full_passes = 0
+        self.roi_passes = 0
+
+    def search_window(self, track):
+        """ Predict the crop from the last two ball points (in model pixels) with a constant velocity
+        :return
+            (y0, x0, crop_height, crop_width), or None if the ball is lost
+        """
+        last, prev = track[-1], track[-2]
+        if last[0] is None:
+            return None
+        cx, cy = last
+        if prev[0] is not None:
+            cx, cy = 2*last[0] - prev[0], 2*last[1] - prev[1]
+        x0 = int(np.clip(cx - self.crop_width/2, 0, self.width - self.crop_width))
+        y0 = int(np.clip(cy - self.crop_height/2, 0, self.height - self.crop_height))
+        return y0, x0, self.crop_height, self.crop_width
+
+    def detect_full(self, ring, output_height, output_width):
+        self.full_passes += 1
+        ring.triplet(out=self.full_input[0])
+        prediction = self.model.predict_on_batch(self.full_input)[0]
+        return decode_prediction(prediction, self.wbce, self.height, self.width,
+                                 output_height, output_width, self.n_classes)
+
+    def detect_crop(self, ring, crop, output_height, output_width):
+        self.roi_passes += 1
+        y0, x0, crop_height, crop_width = crop
+        ring.triplet(out=self.roi_input[0], crop=crop)
+        prediction = self.roi_model.predict_on_batch(self.roi_input)[0]
+        ratio_y, ratio_x = output_height / self.height, output_width / self.width
+        x, y = decode_prediction(prediction, self.wbce, crop_height, crop_width,
+                                 int(round(crop_height*ratio_y)), int(round(crop_width*ratio_x)), self.n_classes)
+        if x is None:
+            return None, None
+        return x + x0*ratio_x, y + y0*ratio_y # crop coordinates back to frame coordinates
+
+    def run(self, frames):
+        """ Track the ball on a stream of consecutive frames
+        :params
+            frames: iterable of consecutive video frames
+        :return
+            generator of (frame, ball point, euclidean distance to the previous ball point), like infer_stream
+        """
+        ring = FrameRing(self.height, self.width)
+        track = [(None, None)]*2 # the last 2 ball points in model pixels
+        since_full = 0
+        prev_ball = (None, None)
+        for frame in frames:
+            ring.push(frame)
+            if not ring.ready():
+                yield frame, (None, None), -1
+                continue
+            output_height, output_width = frame.shape[:2]
+
+            # a crop that misses the ball loses it, the next frame then runs on the full frame
+            crop = self.search_window(track) if since_full < self.reacquire else None
+            if crop is not None:
+                ball = self.detect_crop(ring, crop, output_height, output_width)
+                since_full += 1
+            else: # lost, or time to re-acquire: the full frame
+                ball = self.detect_full(ring, output_height, output_width)
+                since_full = 0
+
+            if ball[0] is None:
+                track = [track[-1], (None, None)]
+            else:
+                track = [track[-1], (ball[0]*self.width/output_width, ball[1]*self.height/output_height)]
+
+            if ball[0] and prev_ball[0]:
+                dist = distance.euclidean(ball, prev_ball)
+            else:  # If the ball is none, not tracked, set the dist=-1.
+                dist = -1
+            prev_ball = ball
+            yield frame, ball, dist
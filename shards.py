@@ -0,0 +1,126 @@
+## Training samples packed into a few large shard files. Reading the JPEGs of a batch is several random small-file
+# reads; a shard is read from start to end, one clip at a time. The frames of a clip are written once (a frame is in 3
+# samples) at model resolution, and the samples only keep the rows of their 3 frames and the label of the ball,
+# the heatmap is drawn from it (see labels.py).
+# Every shard_NNNNN.bin has an index shard_NNNNN.npz:
+#   offsets: byte offset of every frame in the .bin, frames are uint8 (3, input_height, input_width) "channels_first"
+#   clip_frames: first frame of every clip, and the end of the last clip
+#   clip_samples: first sample of every clip, and the end of the last clip
+#   samples: rows of the frames (frame, prev, preprev) of every sample
+#   coordinates: x, y, visibility of every sample in the original frames, x and y are NaN if not visible
+# python shards.py --input_height 360 --input_width 640   (also run by generate_groundtruth.py --shards)
+
+import argparse, os
+from glob import glob
+from pathlib import Path
+import numpy as np
+import cv2
+from label_index import read_labels
+
+
+def shards_path(root, input_height, input_width):
+    """ Default directory of the shards of one model resolution"""
+    return os.path.join(root, 'dataset', 'shards_{}x{}'.format(input_height, input_width))
+
+
+def _write_index(path, num_frames, clip_frames, clip_samples, samples, coordinates_shard, input_height, input_width):
+    np.savez(path + '.npz', offsets=np.arange(num_frames, dtype=np.int64) * (3 * input_height * input_width),
+             frame_shape=np.array([3, input_height, input_width]),
+             clip_frames=np.array(clip_frames + [num_frames], dtype=np.int64),
+             clip_samples=np.array(clip_samples + [len(samples)], dtype=np.int64),
+             samples=np.array(samples, dtype=np.int64).reshape(-1, 3),
+             coordinates=np.array(coordinates_shard, dtype=np.float32).reshape(-1, 3))
+
+
+def write_shards(labels, path_dataset, path_shards, input_height=360, input_width=640, frames_per_shard=1000):
+    """ Pack the samples of a labels table into shards, clip by clip
+    :params
+        labels: LabelIndex of labels_train.csv, see read_labels in label_index.py
+        path_dataset: directory the paths of the labels are relative to
+        path_shards: output directory, the shards already in it are removed
+        input_height, input_width: model resolution
+        frames_per_shard: a new shard is started after the clip that reaches this number of frames
+    :return
+        number of shards
+    """
+    if not len(labels):
+        raise ValueError("no samples to write in the labels")
+    clips = {} # clip_id -> indexes of its samples
+    for i, clip_id in enumerate(labels.clip_ids):
+        clips.setdefault(clip_id, []).append(i)
+    frames = labels.sample_frames() # frame, prev, preprev of every sample, indexes in labels.names
+    coordinates = labels.coordinates()
+
+    os.makedirs(path_shards, exist_ok=True)
+    for path in shard_files(path_shards): # shards of a previous split, they may hold samples of labels_val.csv
+        os.remove(path + '.bin')
+        if os.path.exists(path + '.npz'):
+            os.remove(path + '.npz')
+    num_shards = 0
+    f = None
+    last = max(clips)
+    for key in sorted(clips):
+        if f is None: # a new shard
+            path = os.path.join(path_shards, 'shard_{:05d}'.format(num_shards))
+            f = open(path + '.bin', 'wb')
+            num_frames, clip_frames, clip_samples, samples, coordinates_shard = 0, [], [], [], []
+        clip_frames.append(num_frames)
+        clip_samples.append(len(samples))
+        rows = {} # frame of labels.names -> row in the shard
+        for frame in sorted(set(frames[clips[key]].ravel())): # in frame order, 0000.jpg, 0001.jpg, ...
+            rows[frame] = num_frames
+            img = cv2.imread(os.path.join(path_dataset, labels.frame_path(frame)))
+            f.write(cv2.resize(img, (input_width, input_height)).transpose(2, 0, 1).tobytes()) # "channels_first"
+            num_frames += 1
+        for i in clips[key]:
+            samples.append([rows[frame] for frame in frames[i]])
+            coordinates_shard.append(coordinates[i])
+        if num_frames >= frames_per_shard or key == last:
+            f.close()
+            f = None
+            _write_index(path, num_frames, clip_frames, clip_samples, samples, coordinates_shard, input_height, input_width)
+            print('shard {}: {} frames, {} samples'.format(num_shards, num_frames, len(samples)))
+            num_shards += 1
+    return num_shards
+
+
+def shard_files(path_shards):
+    """ Paths of the shards of a directory, without extension"""
+    return [path[:-len('.bin')] for path in sorted(glob(os.path.join(path_shards, 'shard_*.bin')))]
+
+
+def read_shard(path):
+    """ Read a shard sequentially, one clip at a time
+    :params
+        path: shard path without extension
+    :return
+        generator of (uint8 input (9, input_height, input_width), float32 (x, y, visibility)) in the order of the shard
+    """
+    if isinstance(path, bytes): # from tf.data
+        path = path.decode()
+    index = np.load(path + '.npz')
+    offsets, frame_shape = index['offsets'], tuple(index['frame_shape'])
+    clip_frames, clip_samples = index['clip_frames'], index['clip_samples']
+    samples, coordinates = index['samples'], index['coordinates']
+    with open(path + '.bin', 'rb') as f:
+        for c in range(len(clip_frames) - 1):
+            start, end = clip_frames[c], clip_frames[c + 1]
+            f.seek(offsets[start])
+            block = np.fromfile(f, dtype=np.uint8, count=(end - start) * int(np.prod(frame_shape)))
+            block = block.reshape((end - start,) + frame_shape)
+            for i in range(clip_samples[c], clip_samples[c + 1]):
+                imgs = block[samples[i] - start].reshape((9,) + frame_shape[1:])
+                yield imgs, coordinates[i]
+
+
+if __name__ == '__main__':
+    root = Path(__file__).parent
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_height', type=int, default=360)
+    parser.add_argument('--input_width', type=int, default=640)
+    parser.add_argument('--frames_per_shard', type=int, default=1000)
+    args = parser.parse_args()
+
+    write_shards(read_labels(os.path.join(root, 'labels_train.csv')), root,
+                 shards_path(root, args.input_height, args.input_width), args.input_height, args.input_width,
+                 args.frames_per_shard)
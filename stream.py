@@ -0,0 +1,131 @@
+## Stages of the streaming inference shared by infer.py and engine.py: decoding the model predictions, the outlier
+# removal, tracking and gap filling of the ball points, and writing the output video. The stages are generators of
+# (frame, ball point, dist) chained without keeping the video in memory.
+
+from collections import deque
+from scipy.spatial import distance
+from utils import heatMap, heatMap_1, heatMap_peak
+from track import FilledPoint
+from render import TrackRenderer
+
+def decode_prediction(prediction, wbce, model_height, model_width, output_height, output_width, n_classes=256,
+                      with_score=False):
+    """ Get the ball centre from one model prediction
+    :params
+        prediction: heatmap of TrackNet/U_net (SCCE) or TrackNet2 (WBCE), or (x, y, confidence) of a serving model
+        wbce: True for TrackNet2(U-Net+Sigmoid) + WBCE-loss models
+        with_score: also return the confidence of the prediction in [0, 1], the peak of the heatmap
+    :return
+        x, y: ball centre in the output frame, or None, None
+        score: only with with_score
+    """
+    if prediction.shape == (3,): # the heatmap was already decoded in the graph
+        ball = heatMap_peak(prediction, model_height, model_width, output_height, output_width)
+        return ball + (float(prediction[2]),) if with_score else ball
+    if wbce:
+        return heatMap_1(prediction, model_height, model_width, output_height, output_width, with_score)
+    return heatMap(prediction, n_classes, model_height, model_width, output_height, output_width, with_score)
+
+def remove_outliers_stream(stream, max_dist = 100):
+    """ Remove outliers from a stream of model predictions. It follows the same rule
+    as remove_outliers, but only keeps the previous, current and next point alive.
+    :params
+        stream: iterable of (frame, ball point, dist), e.g. the output of infer_stream
+        max_dist: maximum distance between two neighbouring ball points
+    :return
+        generator of (frame, ball point, dist), delayed by 2 frames
+    """
+    window = deque()
+    skip = False # remove_outliers drops a removed point from the list it iterates, so the next outlier is skipped
+    for item in stream:
+        window.append(list(item))
+        if len(window) < 3:
+            continue
+        prev, cur, nxt = window
+        if cur[2] > max_dist:
+            if skip:
+                skip = False
+            elif (nxt[2] > max_dist) | (nxt[2] == -1):
+                cur[1] = (None, None)
+                skip = True
+            elif prev[2] == -1:
+                prev[1] = (None, None)
+        yield tuple(window.popleft())
+    while window:
+        yield tuple(window.popleft())
+
+def track_online(stream, tracker, cuts=None, confs=None):
+    """ Reject outliers and fill short gaps frame by frame with an online tracker, without delay
+    :params
+        stream: iterable of (frame, ball point, dist), e.g. the output of infer_stream
+        tracker: OnlineTracker
+        cuts: optional set of frame indexes where a new shot starts, e.g. SceneGate.cuts, the tracker is reset there
+        confs: optional list, the confidence of the tracker for every frame is appended to it
+    :return
+        generator of (frame, ball point, dist)
+    """
+    prev_ball = (None, None)
+    for num, (frame, ball, _) in enumerate(stream):
+        if cuts and num in cuts:
+            tracker.reset()
+        x, y, conf, _ = tracker.update(*ball)
+        if confs is not None:
+            confs.append(conf)
+        ball = (x, y)
+        if ball[0] and prev_ball[0]:
+            dist = distance.euclidean(ball, prev_ball)
+        else:
+            dist = -1
+        prev_ball = ball
+        yield frame, ball, dist
+
+def fill_gaps_stream(stream, filler, cuts=None):
+    """ Interpolate short gaps of the ball track with a bounded delay, see GapFiller
+    :params
+        stream: iterable of (frame, ball point, dist), e.g. the output of remove_outliers_stream
+        filler: GapFiller
+        cuts: optional set of frame indexes where a new shot starts, no gap is filled across them
+    :return
+        generator of (frame, ball point, dist), delayed by at most filler.max_gap frames
+    """
+    prev_ball = (None, None)
+    def emit(finalized):
+        nonlocal prev_ball
+        for frame, ball, _ in finalized:
+            if ball[0] and prev_ball[0]:
+                dist = distance.euclidean(ball, prev_ball)
+            else:
+                dist = -1
+            prev_ball = ball
+            yield frame, ball, dist
+    for num, (frame, ball, _) in enumerate(stream):
+        if cuts and num in cuts:
+            yield from emit(filler.reset())
+        yield from emit(filler.push(ball, frame))
+    yield from emit(filler.flush())
+
+def record_track(stream, ball_track, detected_only=False):
+    """ Pass a stream through and append its ball points to ball_track
+    :params
+        stream: iterable of (frame, ball point, dist)
+        ball_track: list of ball points
+        detected_only: append (None, None) for the ball points a tracker filled in (FilledPoint), for the detections
+    :return
+        generator of (frame, ball point, dist)
+    """
+    for frame, ball, dist in stream:
+        ball_track.append((None, None) if detected_only and isinstance(ball, FilledPoint) else ball)
+        yield frame, ball, dist
+
+def write_track_stream(stream, path_output_video, fps, trace=7):
+    """ Write .mp4 file with detected ball tracks while the frames are produced.
+    The frames are encoded on the background thread of a TrackRenderer and released after writing.
+    :params
+        stream: iterable of (frame, ball point, ...), e.g. the output of remove_outliers_stream
+        path_output_video: path to output video
+        fps: frames per second
+        trace: number of frames with detected trace
+    """
+    with TrackRenderer(path_output_video, fps, trace) as renderer:
+        for frame, ball, *_ in stream:
+            renderer.put(frame, ball)
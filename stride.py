@@ -0,0 +1,128 @@
+## Strided inference for high frame rate video. Between neighbouring frames the ball moves almost linearly,
+# so the model only runs on every stride-th frame and the frames in between are interpolated. An interval
+# goes back to per-frame inference when the ball is lost, moves fast or changes direction (a hit or a bounce).
+
+import numpy as np
+from scipy.spatial import distance
+from preprocess import FrameRing
+from stream import decode_prediction
+from track import FilledPoint
+from utils import model_input_size
+
+
+class StridedTracker:
+    """
+    Run TrackNet on every stride-th frame and refine the intervals with fast events frame by frame
+    """
+    def __init__(self, model, wbce=False, stride=2, max_step=30, min_cos=0.5, min_speed=3,
+                 height=None, width=None, n_classes=256):
+        """
+        :params
+            model: pretrained model
+            wbce: True for TrackNet2(U-Net+Sigmoid) + WBCE-loss models
+            stride: number of frames from one model frame to the next
+            max_step: refine the interval when the ball moves more than max_step pixels per frame
+            min_cos: refine the interval when the cosine between the last two motions is below min_cos
+            min_speed: motions slower than min_speed pixels per frame have no reliable direction
+            height, width: input size of the model, read from the model by default
+        """
+        if height is None or width is None:
+            height, width = model_input_size(model)
+        self.model = model
+        self.wbce = wbce
+        self.stride = stride
+        self.max_step = max_step
+        self.min_cos = min_cos
+        self.min_speed = min_speed
+        self.height = height
+        self.width = width
+        self.n_classes = n_classes
+        self.batch = np.empty((stride, 9, height, width), dtype=np.float32)
+        self.model_calls = 0 # number of predict_on_batch calls
+        self.frames_predicted = 0 # number of frames run through the model
+        self.frames_interpolated = 0
+        self.intervals_refined = 0
+
+    def predict(self, ring, nums, frame):
+        """ Run the model on the frames nums of the ring in one batch"""
+        self.model_calls += 1
+        self.frames_predicted += len(nums)
+        for i, num in enumerate(nums):
+            ring.triplet(out=self.batch[i], num=num)
+        predictions = self.model.predict_on_batch(self.batch[:len(nums)])
+        output_height, output_width = frame.shape[:2]
+        return [decode_prediction(prediction, self.wbce, self.height, self.width,
+                                  output_height, output_width, self.n_classes) for prediction in predictions]
+
+    def needs_refinement(self, prev, start, end):
+        """ Decide whether the interval from the model frame start to the model frame end must run frame by frame
+        :params
+            prev, start, end: ball points of the last 3 model frames
+        """
+        if start[0] is None or end[0] is None: # lost, or found again
+            return True
+        motion = np.subtract(end, start) / self.stride
+        speed = np.hypot(*motion)
+        if speed > self.max_step:
+            return True
+        if prev[0] is not None and speed > self.min_speed:
+            prev_motion = np.subtract(start, prev) / self.stride
+            prev_speed = np.hypot(*prev_motion)
+            if prev_speed > self.min_speed and motion @ prev_motion / (speed*prev_speed) < self.min_cos:
+                return True
+        return False
+
+    def run(self, frames):
+        """ Track the ball on a stream of consecutive frames
+        :params
+            frames: iterable of consecutive video frames
+        :return
+            generator of (frame, ball point, euclidean distance to the previous ball point), like infer_stream,
+            delayed by at most stride frames, the interpolated ball points are FilledPoint
+        """
+        # the skipped frames of an interval are refined with the previous 2 frames, stride + 2 in total
+        ring = FrameRing(self.height, self.width, size=self.stride + 2)
+        pending = [] # frames after the last model frame
+        prev, last = (None, None), (None, None) # ball points of the last 2 model frames
+        prev_ball = (None, None)
+
+        def emit(items):
+            nonlocal prev_ball
+            for frame, ball in items:
+                if ball[0] and prev_ball[0]:
+                    dist = distance.euclidean(ball, prev_ball)
+                else:  # If the ball is none, not tracked, set the dist=-1.
+                    dist = -1
+                prev_ball = ball
+                yield frame, ball, dist
+
+        for frame in frames:
+            ring.push(frame)
+            num = ring.count - 1
+            if not ring.ready():
+                yield from emit([(frame, (None, None))])
+                continue
+            if num == 2: # the first model frame
+                prev, last = last, self.predict(ring, [num], frame)[0]
+                yield from emit([(frame, last)])
+                continue
+            pending.append(frame)
+            if len(pending) < self.stride:
+                continue
+
+            ball = self.predict(ring, [num], frame)[0]
+            skipped = list(range(num - self.stride + 1, num))
+            if self.needs_refinement(prev, last, ball):
+                self.intervals_refined += 1
+                balls = self.predict(ring, skipped, frame) if skipped else []
+            else:
+                self.frames_interpolated += len(skipped)
+                balls = [FilledPoint(float(v) for v in np.add(last, np.subtract(ball, last) * k / self.stride))
+                         for k in range(1, self.stride)]
+            yield from emit(zip(pending, balls + [ball]))
+            prev, last = last, ball
+            pending = []
+
+        if pending: # the last, incomplete interval
+            num = ring.count - 1
+            yield from emit(zip(pending, self.predict(ring, list(range(num - len(pending) + 1, num + 1)), pending[-1])))
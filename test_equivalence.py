@@ -0,0 +1,363 @@
+## Equivalence of the array and streaming versions with the list-based and JPEG-based code they replaced,
+# on synthetic tracks and labels. Run with python -m pytest test_equivalence.py
+
+import os
+from itertools import groupby
+import numpy as np
+import pandas as pd
+import cv2
+import pytest
+from scipy.spatial import distance
+from track import (track_from_list, track_to_list, track_dists, remove_outliers_array, split_track_array,
+                   interpolate_track, OnlineTracker, GapFiller)
+from stream import remove_outliers_stream
+from labels import HeatmapStamper
+from label_index import LabelIndex, save_label_index, index_path, read_labels
+
+
+# The list-based post-processing of infer.py before the track arrays
+
+def old_remove_outliers(ball_track, dists, max_dist=100):
+    outliers = list(np.where(np.array(dists) > max_dist)[0])
+    for i in outliers:
+        if i+1>=len(dists):
+            break
+        if (dists[i+1] > max_dist) | (dists[i+1] == -1):
+            ball_track[i] = (None, None)
+            outliers.remove(i)
+        elif dists[i-1] == -1:
+            ball_track[i-1] = (None, None)
+    return ball_track
+
+
+def old_split_track(ball_track, max_gap=4, max_dist_gap=80, min_track=5):
+    list_det = [0 if x[0] else 1 for x in ball_track]
+    groups = [(k, sum(1 for _ in g)) for k, g in groupby(list_det)]
+
+    cursor = 0
+    min_value = 0
+    result = []
+    for i, (k, l) in enumerate(groups):
+        if (k == 1) & (i > 0) & (i < len(groups) - 1):
+            dist = distance.euclidean(ball_track[cursor-1], ball_track[cursor+l])
+            if (l >=max_gap) | (dist/l > max_dist_gap):
+                if cursor - min_value > min_track:
+                    result.append([min_value, cursor])
+                    min_value = cursor + l - 1
+        cursor += l
+    if len(list_det) - min_value > min_track:
+        result.append([min_value, len(list_det)])
+    return result
+
+
+def old_interpolation(coords):
+    def nan_helper(y):
+        return np.isnan(y), lambda z: z.nonzero()[0]
+
+    x = np.array([x[0] if x[0] is not None else np.nan for x in coords])
+    y = np.array([x[1] if x[1] is not None else np.nan for x in coords])
+
+    nons, yy = nan_helper(x)
+    x[nons]= np.interp(yy(nons), yy(~nons), x[~nons])
+    nans, xx = nan_helper(y)
+    y[nans]= np.interp(xx(nans), xx(~nans), y[~nans])
+
+    return [*zip(x,y)]
+
+
+def old_dists(ball_track):
+    """ The dists of infer_model: -1 if one of the two points is missing"""
+    dists = [-1]
+    for prev, cur in zip(ball_track, ball_track[1:]):
+        dists.append(distance.euclidean(cur, prev) if cur[0] and prev[0] else -1)
+    return dists
+
+
+def random_track(rng, n, p_missing=0.2, p_spike=0.1):
+    """ Ball points moving at a few pixels per frame, with missing frames and far outliers"""
+    track = []
+    x, y = 640.0, 360.0
+    for _ in range(n):
+        x += rng.normal(0, 8)
+        y += rng.normal(0, 8)
+        r = rng.random()
+        if r < p_missing:
+            track.append((None, None))
+        elif r < p_missing + p_spike:
+            track.append((float(rng.integers(1, 1280)), float(rng.integers(1, 720))))
+        else:
+            track.append((float(round(x)), float(round(y))))
+    return track
+
+
+def same_points(a, b, tol=1e-3):
+    if len(a) != len(b):
+        return False
+    for (xa, ya), (xb, yb) in zip(a, b):
+        if (xa is None) != (xb is None):
+            return False
+        if xa is not None and (abs(xa - xb) > tol or abs(ya - yb) > tol):
+            return False
+    return True
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_track_dists(seed):
+    ball_track = random_track(np.random.default_rng(seed), 200)
+    assert np.allclose(track_dists(track_from_list(ball_track)), old_dists(ball_track))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_remove_outliers_array(seed):
+    ball_track = random_track(np.random.default_rng(seed), 200)
+    dists = old_dists(ball_track)
+    expected = old_remove_outliers(list(ball_track), dists)
+    assert same_points(track_to_list(remove_outliers_array(track_from_list(ball_track), dists)), expected)
+    assert same_points(track_to_list(remove_outliers_array(track_from_list(ball_track))), expected)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_remove_outliers_stream(seed):
+    ball_track = random_track(np.random.default_rng(seed), 200)
+    stream = zip(range(len(ball_track)), ball_track, old_dists(ball_track))
+    streamed = [ball for _, ball, _ in remove_outliers_stream(stream)]
+    assert same_points(streamed, old_remove_outliers(list(ball_track), old_dists(ball_track)))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_split_track_array(seed):
+    ball_track = random_track(np.random.default_rng(seed), 300, p_missing=0.3, p_spike=0.05)
+    assert split_track_array(track_from_list(ball_track)) == old_split_track(ball_track)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_interpolate_track(seed):
+    ball_track = random_track(np.random.default_rng(seed), 300, p_missing=0.3, p_spike=0.05)
+    track = track_from_list(ball_track)
+    expected = list(ball_track)
+    for start, end in old_split_track(ball_track):
+        expected[start:end] = old_interpolation(expected[start:end])
+        interpolate_track(track, start, end)
+    assert same_points(track_to_list(track), expected)
+
+
+def test_track_list_round_trip():
+    ball_track = random_track(np.random.default_rng(0), 50)
+    assert same_points(track_to_list(track_from_list(ball_track)), ball_track)
+    assert track_to_list(track_from_list([])) == []
+
+
+def run_tracker(ball_track, tracker=None):
+    tracker = OnlineTracker() if tracker is None else tracker
+    return [tracker.update(*ball) for ball in ball_track]
+
+
+def test_online_tracker_keeps_a_clean_track():
+    ball_track = [(100.0 + 7*i, 200.0 + 3*i) for i in range(50)]
+    out = run_tracker(ball_track)
+    assert all(status == 'detected' for *_, status in out)
+    assert same_points([(x, y) for x, y, _, _ in out], ball_track)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_online_tracker_rejects_the_outliers_of_remove_outliers(seed):
+    # isolated far spikes on a smooth track: remove_outliers removes them, the tracker rejects the same frames
+    rng = np.random.default_rng(seed)
+    ball_track = [(300.0 + 6*i, 300.0 + 2*i) for i in range(80)]
+    spikes = rng.choice(np.arange(5, 75, 3), size=6, replace=False)
+    for i in spikes:
+        ball_track[i] = (ball_track[i][0] + 400, ball_track[i][1] - 250)
+    removed = [i for i, ball in enumerate(old_remove_outliers(list(ball_track), old_dists(ball_track))) if ball[0] is None]
+    rejected = [i for i, (*_, status) in enumerate(run_tracker(ball_track)) if status != 'detected']
+    assert sorted(removed) == sorted(spikes.tolist())
+    assert rejected == removed
+
+
+def test_online_tracker_fills_and_loses_gaps():
+    ball_track = [(100.0 + 5*i, 100.0) for i in range(20)]
+    for i in range(8, 11): # shorter than max_gap: filled on the line
+        ball_track[i] = (None, None)
+    for i in range(14, 20): # longer than max_gap: lost
+        ball_track[i] = (None, None)
+    out = run_tracker(ball_track, OnlineTracker(max_gap=4))
+    for i in range(8, 11):
+        x, y, conf, status = out[i]
+        assert status == 'filled' and abs(x - (100 + 5*i)) < 1 and abs(y - 100) < 1 and 0 < conf < 1
+    assert [status for *_, status in out[14:]] == ['filled']*4 + ['lost']*2
+    tracker = OnlineTracker()
+    run_tracker(ball_track[:5], tracker)
+    tracker.reset()
+    assert tracker.update(None, None)[3] == 'lost'
+
+
+def run_filler(ball_track, filler=None):
+    filler = GapFiller() if filler is None else filler
+    out = []
+    for num, ball in enumerate(ball_track):
+        out += filler.push(ball, num)
+    out += filler.flush()
+    assert [num for num, _, _ in out] == list(range(len(ball_track))) # every frame once, in order
+    return out
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_gap_filler_short_gaps(seed):
+    # gaps shorter than max_gap after a long enough subtrack and closed by a detection: the batch
+    # split_track + interpolation fills them the same way
+    rng = np.random.default_rng(seed)
+    ball_track = [(100.0 + 9*i + rng.normal(0, 2), 50.0 + 4*i + rng.normal(0, 2)) for i in range(120)]
+    i = 8
+    while i < 115:
+        gap = int(rng.integers(1, 4))
+        ball_track[i:i+gap] = [(None, None)]*gap
+        i += gap + int(rng.integers(1, 6))
+    expected = list(ball_track)
+    for start, end in old_split_track(ball_track):
+        expected[start:end] = old_interpolation(expected[start:end])
+    out = run_filler(ball_track)
+    assert same_points([ball for _, ball, _ in out], expected)
+    assert [interpolated for _, _, interpolated in out] == [ball[0] is None for ball in ball_track]
+
+
+def test_gap_filler_delay_and_long_gaps():
+    ball_track = [(10.0*i, 0.0) for i in range(10)] + [(None, None)]*5 + [(150.0, 0.0)]
+    filler = GapFiller(max_gap=4)
+    for num, ball in enumerate(ball_track[:13]):
+        filler.push(ball, num)
+    assert len(filler.gap) == 3 # held while the gap may still close
+    assert [ball for _, ball, _ in filler.push((None, None), 13)] == [(None, None)]*4
+    assert filler.last is None # the long gap ended the subtrack
+    assert filler.reset() == []
+
+
+# The ground truth heatmaps of generate_groundtruth.py, drawn at full resolution, saved without compression
+# and read back at model resolution by get_output
+
+def old_heatmap(x, y, vis, size=20, variance=10, width=1280, height=720):
+    x_grid, y_grid = np.mgrid[-size:size+1, -size:size+1]
+    g = np.exp(-(x_grid**2+y_grid**2)/float(2*variance))
+    kernel = (g * 255/g[size][size]).astype(int)
+    heatmap = np.zeros((height, width), dtype=np.uint8)
+    if vis != 0:
+        x = int(x)
+        y = int(y)
+        for i in range(-size, size+1):
+            for j in range(-size, size+1):
+                if x+i<width and x+i>=0 and y+j<height and y+j>=0 and kernel[i+size][j+size] > 0:
+                    heatmap[y+j, x+i] = kernel[i+size][j+size]
+    return heatmap
+
+
+def old_output(heatmap, input_height=360, input_width=640):
+    img = cv2.resize(heatmap, (input_width, input_height))
+    return (img/255 > 0.5).astype('float32').reshape(input_width * input_height)
+
+
+LABELS = [(640, 360, 1), (0, 0, 1), (1279, 719, 2), (3, 700, 1), (1275, 5, 3), (500, 200, 0), (-4, 360, 1)]
+
+
+@pytest.mark.parametrize('x, y, vis', LABELS)
+def test_stamp_matches_the_heatmap_images(x, y, vis):
+    stamper = HeatmapStamper(360, 640, 720, 1280)
+    expected = old_output(old_heatmap(x, y, vis))
+    got = stamper.stamp(x, y, vis)
+    assert got.shape == expected.shape and got.dtype == np.float32
+    # the kernel is sampled at model resolution instead of resizing the full frame, the disk may differ
+    # in a couple of pixels on its rim
+    assert np.count_nonzero(got != expected) <= 2
+    assert got.sum() == pytest.approx(expected.sum(), abs=2)
+
+
+def test_stamp_into_buffer():
+    stamper = HeatmapStamper(360, 640, 720, 1280)
+    out = np.ones(360*640, dtype=np.float32)
+    assert stamper.stamp(100, 100, 1, out=out) is out
+    assert np.array_equal(out, stamper.stamp(100, 100, 1))
+    assert not stamper.stamp(100, 100, 0, out=out).any()
+
+
+@pytest.mark.parametrize('size', [(360, 640), (288, 512), (180, 320)])
+def test_tf_stamp_matches_stamp(size):
+    import tensorflow as tf
+    stamper = HeatmapStamper(*size, 720, 1280)
+    rng = np.random.default_rng(0)
+    labels = LABELS + [(float(x), float(y), 1) for x, y in rng.uniform((-30, -30), (1310, 750), (60, 2))]
+    labels += [(np.nan, np.nan, 0), (np.nan, np.nan, 1)]
+    for x, y, vis in labels:
+        expected = stamper.stamp(0 if np.isnan(x) else x, 0 if np.isnan(y) else y, 0 if np.isnan(x) else vis)
+        got = stamper.tf_stamp(tf.constant(x, tf.float32), tf.constant(y, tf.float32), tf.constant(vis, tf.float32))
+        assert np.array_equal(got.numpy(), expected), (x, y, vis)
+
+
+# labels_train.csv and labels_val.csv, and their binary index
+
+def write_labels_csv(path, clips, rng):
+    """ A labels CSV of generate_groundtruth.py for clips {(game, clip): number of frames}"""
+    rows = []
+    for (game, clip), num_frames in clips.items():
+        names = ['{:04d}.jpg'.format(i) for i in range(num_frames)]
+        for i in range(2, num_frames):
+            vis = int(rng.integers(0, 4))
+            x, y = (np.nan, np.nan) if vis == 0 else (int(rng.integers(0, 1280)), int(rng.integers(0, 720)))
+            status = np.nan if vis == 0 else int(rng.integers(0, 3))
+            rows.append(['dataset/images/{}/{}/{}'.format(game, clip, names[i - k]) for k in range(3)] +
+                        ['dataset/gaussian_heatmap/{}/{}/{}'.format(game, clip, names[i]), x, y, status, vis])
+    data = pd.DataFrame(rows, columns=['path1', 'path2', 'path3', 'gt_path', 'x-coordinate', 'y-coordinate',
+                                       'status', 'visibility'])
+    data = data.sample(frac=1, random_state=0).reset_index(drop=True) # the train/val split shuffles the samples
+    data.to_csv(path, index=False)
+    return data
+
+
+CLIPS = {('game1', 'Clip1'): 12, ('game1', 'Clip2'): 5, ('game10', 'Clip1'): 8, ('game2', 'Clip7'): 3}
+
+
+def test_label_index_round_trip(tmp_path):
+    path_csv = str(tmp_path / 'labels_train.csv')
+    write_labels_csv(path_csv, CLIPS, np.random.default_rng(0))
+    expected = pd.read_csv(path_csv)
+    labels = LabelIndex.from_csv(path_csv)
+    assert len(labels) == len(expected)
+    pd.testing.assert_frame_equal(labels.to_frame(), expected, check_dtype=False)
+
+    save_label_index(index_path(path_csv), labels.games, labels.clips, labels.names, labels.clip_start, labels.rows)
+    loaded = LabelIndex.load(index_path(path_csv))
+    pd.testing.assert_frame_equal(loaded.to_frame(), expected, check_dtype=False)
+    assert isinstance(read_labels(path_csv), LabelIndex)
+
+
+def test_label_index_arrays(tmp_path):
+    path_csv = str(tmp_path / 'labels_val.csv')
+    expected = write_labels_csv(path_csv, CLIPS, np.random.default_rng(1))
+    labels = LabelIndex.from_csv(path_csv)
+    frames = labels.sample_frames()
+    for column, k in zip(['path1', 'path2', 'path3'], range(3)):
+        assert [labels.frame_path(f) for f in frames[:, k]] == list(expected[column])
+    assert [labels.frame_path(f, 'dataset/gaussian_heatmap') for f in frames[:, 0]] == list(expected['gt_path'])
+    coordinates = labels.coordinates()
+    assert np.allclose(coordinates[:, 0], expected['x-coordinate'], equal_nan=True)
+    assert np.allclose(coordinates[:, 1], expected['y-coordinate'], equal_nan=True)
+    assert np.array_equal(coordinates[:, 2], expected['visibility'])
+    clip_of = {key: i for i, key in enumerate(zip(labels.games, labels.clips))}
+    assert [clip_of[tuple(path.split('/')[2:4])] for path in expected['path1']] == list(labels.clip_ids)
+
+
+def test_label_index_rejects_other_frames(tmp_path):
+    path_csv = str(tmp_path / 'labels_train.csv')
+    data = write_labels_csv(path_csv, CLIPS, np.random.default_rng(2))
+    data.loc[0, 'path2'] = data.loc[0, 'path1'] # not the frame before path1
+    data.to_csv(path_csv, index=False)
+    with pytest.raises(ValueError):
+        LabelIndex.from_csv(path_csv)
+
+
+def test_read_labels_prefers_a_newer_index(tmp_path):
+    path_csv = str(tmp_path / 'labels_train.csv')
+    write_labels_csv(path_csv, CLIPS, np.random.default_rng(3))
+    labels = LabelIndex.from_csv(path_csv)
+    save_label_index(index_path(path_csv), labels.games, labels.clips, labels.names, labels.clip_start,
+                     labels.rows[:3])
+    os.utime(path_csv, (1, 1)) # older than the index
+    assert len(read_labels(path_csv)) == 3
+    os.utime(index_path(path_csv), (0, 0)) # older than the CSV
+    assert len(read_labels(path_csv)) == len(labels)
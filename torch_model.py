@@ -77,9 +77,13 @@ class BallTrackerNet(nn.Module):
         self._init_weights()
 
     def forward(self, x, testing=False):
-        batch_size = x.size(0)
+        batch_size, _, height, width = x.shape
+        # zero pad the bottom and the right, so the 3 max poolings divide the input size
+        pad_height, pad_width = -height % 8, -width % 8
+        if pad_height or pad_width:
+            x = nn.functional.pad(x, (0, pad_width, 0, pad_height))
         features = self.encoder(x)
-        scores_map = self.decoder(features)
+        scores_map = self.decoder(features)[:, :, :height, :width]
         output = scores_map.reshape(batch_size, self.out_channels, -1)
         # output = output.permute(0, 2, 1)
         if testing:
@@ -98,33 +102,40 @@ class BallTrackerNet(nn.Module):
                 nn.init.constant_(module.bias, 0)
 
     def inference(self, frames: torch.Tensor):
+        return self.inference_batch(frames)[0]
+
+    def inference_batch(self, frames: torch.Tensor):
+        """
+        Detect the ball on a batch of inputs with a single forward pass
+        :param frames: (batch, 9, height, width) or (9, height, width) tensor
+        :return: list of the ball`s centers, (None, None) if not detected
+        """
         self.eval()
-        with torch.no_grad():
+        with torch.inference_mode():
             if len(frames.shape) == 3:
                 frames = frames.unsqueeze(0)
-            if next(self.parameters()).is_cuda:
-                frames.cuda()
+            frames = frames.to(next(self.parameters()).device)
             # Forward pass
             output = self(frames, True)
-            output = output.argmax(dim=1).detach().cpu().numpy()
+            output = output.argmax(dim=1).cpu().numpy()
             if self.out_channels == 2:
                 output *= 255
-            x, y = self.get_center_ball(output)
-        return x, y
+            return [self.get_center_ball(o, frames.shape[2], frames.shape[3]) for o in output]
 
-    def get_center_ball(self, output):
+    def get_center_ball(self, output, height=360, width=640):
         """
         Detect the center of the ball using Hough circle transform
         :param output: output of the network
+        :param height, width: input size of the network
         :return: indices of the ball`s center
         """
-        output = output.reshape((360, 640))
+        output = output.reshape((height, width))
 
         # cv2 image must be numpy.uint8, convert numpy.int64 to numpy.uint8
         output = output.astype(np.uint8)
 
         # reshape the image size as original input image
-        heatmap = cv2.resize(output, (640, 360))
+        heatmap = cv2.resize(output, (width, height))
 
         # heatmap is converted into a binary image by threshold method.
         ret, heatmap = cv2.threshold(heatmap, 127, 255, cv2.THRESH_BINARY)
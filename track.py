@@ -0,0 +1,344 @@
+## Array-backed ball track and vectorized post-processing (outlier removal, splitting and interpolation).
+# A track is a structured numpy array with one row per frame instead of a list of (x, y) tuples with None.
+
+import numpy as np
+
+TRACK_DTYPE = np.dtype([('frame', np.int32), # frame index
+                        ('x', np.float32),
+                        ('y', np.float32),
+                        ('conf', np.float32), # confidence of the detection
+                        ('valid', np.bool_)]) # False when the ball is not tracked
+
+
+def make_track(n):
+    """ Empty track of n frames, no ball tracked"""
+    track = np.zeros(n, dtype=TRACK_DTYPE)
+    track['frame'] = np.arange(n)
+    track['x'] = np.nan
+    track['y'] = np.nan
+    return track
+
+
+def track_from_list(ball_track, confs=None):
+    """ Convert a list of (x, y) ball points with (None, None) for missing balls to a track"""
+    track = make_track(len(ball_track))
+    valid = np.array([x is not None for x, _ in ball_track], dtype=bool)
+    if valid.any():
+        xy = np.array([p for p, v in zip(ball_track, valid) if v], dtype=np.float32)
+        track['x'][valid] = xy[:, 0]
+        track['y'][valid] = xy[:, 1]
+    track['valid'] = valid
+    track['conf'] = valid if confs is None else confs
+    return track
+
+
+def track_to_list(track):
+    """ Convert a track back to a list of (x, y) ball points with (None, None) for missing balls"""
+    return [(float(x), float(y)) if v else (None, None) for x, y, v in zip(track['x'], track['y'], track['valid'])]
+
+
+def track_dists(track):
+    """ Euclidean distances between neighbouring ball points, -1 if one of them is not tracked"""
+    dists = np.full(len(track), -1.0)
+    if len(track) > 1:
+        both = track['valid'][1:] & track['valid'][:-1]
+        step = np.hypot(np.diff(track['x']), np.diff(track['y']))
+        dists[1:][both] = step[both]
+    return dists
+
+
+def remove_outliers_array(track, dists=None, max_dist=100):
+    """ Remove outliers from model prediction, the rule of infer.remove_outliers on whole arrays
+    :params
+        track: ball track
+        dists: distances between two neighbouring ball points, computed from the track if None
+        max_dist: maximum distance between two neighbouring ball points
+    :return
+        track: copy of the track without the outliers
+    """
+    track = track.copy()
+    dists = track_dists(track) if dists is None else np.asarray(dists, dtype=np.float64)
+    n = len(dists)
+    if n < 3:
+        return track
+    i = np.flatnonzero(dists[1:-1] > max_dist) + 1 # the last point has no next distance to compare with
+    nxt = dists[i+1]
+    jump_back = (nxt > max_dist) | (nxt == -1) # the point i jumps away and does not come back
+    # remove_outliers drops a removed point from the list it iterates, so the outlier after it is skipped;
+    # the loop only runs over the outliers
+    checked = np.ones(len(i), dtype=bool)
+    for k in range(1, len(i)):
+        checked[k] = not (checked[k-1] and jump_back[k-1])
+    i, jump_back = i[checked], jump_back[checked]
+    track['valid'][i[jump_back]] = False
+    lonely = i[~jump_back & (dists[i-1] == -1)] # the point before the jump has no neighbour
+    track['valid'][lonely-1] = False
+    removed = ~track['valid']
+    track['x'][removed] = np.nan
+    track['y'][removed] = np.nan
+    track['conf'][removed] = 0
+    return track
+
+
+def split_track_array(track, max_gap=4, max_dist_gap=80, min_track=5):
+    """ Split ball track into subtracks in each of which we will perform ball interpolation,
+    the rule of infer.split_track with the gaps found by array operations
+    :params
+        track: ball track
+        max_gap: maximun number of coherent missing values for interpolation
+        max_dist_gap: maximum distance at which neighboring points remain in one subtrack
+        min_track: minimum number of frames in each subtrack
+    :return
+        result: list of [start, end) subtrack indexes
+    """
+    n = len(track)
+    missing = np.concatenate(([False], ~track['valid'], [False])).astype(np.int8)
+    edges = np.diff(missing)
+    starts = np.flatnonzero(edges == 1)
+    lengths = np.flatnonzero(edges == -1) - starts
+    interior = (starts > 0) & (starts + lengths < n) # gaps with a ball point on both sides
+    starts, lengths = starts[interior], lengths[interior]
+    before, after = track[starts-1], track[starts+lengths]
+    dist = np.hypot(after['x'] - before['x'], after['y'] - before['y'])
+    breaks = (lengths >= max_gap) | (dist/lengths > max_dist_gap)
+
+    min_value = 0
+    result = []
+    for cursor, l in zip(starts[breaks], lengths[breaks]): # only the gaps that split the track
+        if cursor - min_value > min_track:
+            result.append([min_value, int(cursor)])
+            min_value = int(cursor + l - 1)
+    if n - min_value > min_track:
+        result.append([min_value, n])
+    return result
+
+
+def interpolate_track(track, start=0, end=None):
+    """ Run ball interpolation in one subtrack, in place
+    :params
+        track: ball track
+        start, end: subtrack indexes
+    :return
+        track
+    """
+    sub = track[start:end]
+    valid = sub['valid']
+    if valid.all() or not valid.any():
+        return track
+    idx = np.arange(len(sub))
+    sub['x'][~valid] = np.interp(idx[~valid], idx[valid], sub['x'][valid])
+    sub['y'][~valid] = np.interp(idx[~valid], idx[valid], sub['y'][valid])
+    sub['valid'] = True
+    return track
+
+
+class OnlineTracker:
+    """
+    Constant velocity Kalman filter for streaming outlier rejection. On every frame it accepts or rejects
+    the detection, fills short gaps with the predicted position and reports a confidence, at O(1) cost.
+    """
+    def __init__(self, max_dist=100, max_gap=4, process_noise=4.0, measurement_noise=4.0):
+        """
+        :params
+            max_dist: maximum distance between the predicted and the detected ball point, the same bound as remove_outliers
+            max_gap: maximum number of missing or rejected frames filled by prediction before the ball is lost
+            process_noise: variance of the acceleration, in pixels per frame^2
+            measurement_noise: variance of the detected position, in pixels^2
+        """
+        self.max_dist = max_dist
+        self.max_gap = max_gap
+        self.F = np.array([[1, 0, 1, 0], # x += vx
+                           [0, 1, 0, 1], # y += vy
+                           [0, 0, 1, 0],
+                           [0, 0, 0, 1]], dtype=np.float64)
+        self.H = np.eye(2, 4)
+        G = np.array([[0.5, 0], [0, 0.5], [1, 0], [0, 1]])
+        self.Q = G @ G.T * process_noise
+        self.R = np.eye(2) * measurement_noise
+        self.reset()
+
+    def reset(self):
+        """ Forget the ball, e.g. after a scene cut"""
+        self.state = None # x, y, vx, vy
+        self.P = None
+        self.missed = 0
+
+    def update(self, x, y):
+        """ Feed the detection of the next frame
+        :params
+            x, y: detected ball point, or None, None
+        :return
+            x, y: accepted or predicted ball point, or None, None when the ball is lost
+            conf: confidence of the ball point, 0 when lost
+            status: 'detected', 'filled' or 'lost'
+        """
+        if self.state is None:
+            if x is None:
+                return None, None, 0.0, 'lost'
+            self.state = np.array([x, y, 0, 0], dtype=np.float64)
+            self.P = np.diag([1.0, 1.0, 100.0, 100.0]) * self.R[0, 0]
+            self.missed = 0
+            return x, y, 1.0, 'detected'
+
+        # predict
+        self.state = self.F @ self.state
+        self.P = self.F @ self.P @ self.F.T + self.Q
+
+        if x is not None:
+            innovation = np.array([x, y]) - self.state[:2]
+            if np.hypot(*innovation) <= self.max_dist:
+                S = self.P[:2, :2] + self.R
+                S_inv = np.linalg.inv(S)
+                K = self.P[:, :2] @ S_inv
+                self.state = self.state + K @ innovation
+                self.P = self.P - K @ self.H @ self.P
+                self.missed = 0
+                conf = float(np.exp(-0.5 * innovation @ S_inv @ innovation))
+                return x, y, max(conf, 1e-3), 'detected'
+
+        # missing or rejected detection
+        self.missed += 1
+        if self.missed > self.max_gap:
+            self.reset()
+            return None, None, 0.0, 'lost'
+        return float(self.state[0]), float(self.state[1]), 0.5**self.missed, 'filled'
+
+
+class GapFiller:
+    """
+    Incremental version of split_track + interpolation for live output. Frames of an open gap are held
+    for at most max_gap frames, and are emitted, interpolated or not, as soon as the gap closes or gets too long.
+    A gap is filled when it is shorter than max_gap, the ball moves at most max_dist_gap per missing frame
+    and the subtrack before the gap has more than min_track frames.
+    """
+    def __init__(self, max_gap=4, max_dist_gap=80, min_track=5):
+        self.max_gap = max_gap
+        self.max_dist_gap = max_dist_gap
+        self.min_track = min_track
+        self.last = None # last ball point of the current subtrack
+        self.length = 0 # number of frames of the current subtrack
+        self.gap = [] # payloads of the frames of the open gap
+
+    def push(self, ball, payload=None):
+        """ Feed the ball point of the next frame
+        :params
+            ball: (x, y), or (None, None)
+            payload: anything to keep with the frame, e.g. the frame itself
+        :return
+            list of finalized (payload, ball point, interpolated) in frame order, may be empty
+        """
+        if ball[0] is None:
+            if self.last is None: # not in a subtrack, nothing to fill
+                return [(payload, (None, None), False)]
+            self.gap.append(payload)
+            if len(self.gap) < self.max_gap:
+                return []
+            # too long, the subtrack ends here
+            result = [(p, (None, None), False) for p in self.gap]
+            self.gap = []
+            self.last = None
+            self.length = 0
+            return result
+
+        result = []
+        if self.gap:
+            l = len(self.gap)
+            dx, dy = ball[0] - self.last[0], ball[1] - self.last[1]
+            if np.hypot(dx, dy)/l > self.max_dist_gap: # the ball jumped, a new subtrack starts
+                result = [(p, (None, None), False) for p in self.gap]
+                self.length = 0
+            elif self.length > self.min_track:
+                for k, p in enumerate(self.gap, 1):
+                    t = k/(l+1)
+                    result.append((p, (self.last[0] + t*dx, self.last[1] + t*dy), True))
+                self.length += l
+            else: # the subtrack is still too short to interpolate
+                result = [(p, (None, None), False) for p in self.gap]
+                self.length += l
+            self.gap = []
+        result.append((payload, ball, False))
+        self.last = ball
+        self.length += 1
+        return result
+
+    def flush(self):
+        """ Emit the frames of the open gap at the end of the stream"""
+        result = [(p, (None, None), False) for p in self.gap]
+        self.gap = []
+        return result
+
+    def reset(self):
+        """ End the subtrack, e.g. at a scene cut, the open gap is emitted without interpolation"""
+        result = self.flush()
+        self.last = None
+        self.length = 0
+        return result
+
+
+## Track files. One fixed-size row per frame in a .npy file, which is memory mapped when loaded,
+# so the track of a whole match is available without decoding the video or running the model.
+
+TRACK_FILE_DTYPE = np.dtype([('frame', np.int32),
+                             ('t', np.float64), # timestamp in seconds
+                             ('x', np.float32), # ball point in video pixels, nan if not tracked
+                             ('y', np.float32),
+                             ('conf', np.float32), # confidence of the model or of the tracker, nan if there is none
+                             ('flags', np.uint8)]) # INTERPOLATED | OUTLIER
+
+INTERPOLATED = 1 # the ball point was not detected, it was filled by interpolation or prediction
+OUTLIER = 2 # the detected ball point was removed or replaced by the post-processing
+
+
+class FilledPoint(tuple):
+    """
+    Ball point (x, y) a tracker filled in without running the model on its frame, e.g. the interpolated frames of
+    StridedTracker. It is used like any ball point; record_track(..., detected_only=True) leaves it out of the
+    detections, so make_track_file flags the frame as INTERPOLATED.
+    """
+    __slots__ = ()
+
+
+def make_track_file(detections, ball_track, fps, confs=None):
+    """ Build the rows of a track file
+    :params
+        detections: list of ball points detected by the model, before post-processing
+        ball_track: list of ball points after removing the outliers and interpolation
+        fps: frames per second, for the timestamps, float (e.g. 29.97), see read_video_stream
+        confs: optional confidence of every frame, e.g. the heatmap peak of the model (infer_stream) or the
+               confidence of the OnlineTracker (track_online). Without it conf is nan.
+    :return
+        rows: array of TRACK_FILE_DTYPE
+    """
+    if not fps > 0:
+        raise ValueError(f"fps must be positive to compute the timestamps, got {fps}")
+    raw, final = track_from_list(detections), track_from_list(ball_track)
+    rows = np.zeros(len(final), dtype=TRACK_FILE_DTYPE)
+    rows['frame'] = final['frame']
+    rows['t'] = final['frame'] / fps
+    rows['x'] = final['x']
+    rows['y'] = final['y']
+    rows['conf'] = confs if confs is not None else np.nan
+    moved = raw['valid'] & final['valid'] & ((raw['x'] != final['x']) | (raw['y'] != final['y']))
+    outlier = raw['valid'] & (~final['valid'] | moved)
+    filled = final['valid'] & (~raw['valid'] | moved)
+    rows['flags'] = np.where(filled, INTERPOLATED, 0) | np.where(outlier, OUTLIER, 0)
+    return rows
+
+
+def save_track(path, rows):
+    """ Write a track file, see make_track_file"""
+    np.save(path, rows, allow_pickle=False)
+
+
+def load_track(path, mmap=True):
+    """ Read a track file
+    :params
+        path: path to .npy track file
+        mmap: map the file instead of reading it, only the rows which are used are loaded
+    :return
+        rows: array of TRACK_FILE_DTYPE
+    """
+    rows = np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
+    if rows.dtype != TRACK_FILE_DTYPE:
+        raise ValueError(f"{path} is not a track file, dtype {rows.dtype}")
+    return rows
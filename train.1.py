@@ -1,8 +1,12 @@
 ## This is trianing TrackNetV2 by modifying the TrackNet model
 
 from model import TrackNet2, TrackNet, U_net
-from datasets import TrackNetDataset
+from datasets import TrackNetDataset, tf_dataset, shard_dataset, video_dataset
 from custom_callback import ValidationCallback
+from frame_store import FrameStore
+from labels import HeatmapStamper
+from clip_sampler import SharedFrameCache
+from video_source import video_clips
 import argparse, os
 from pathlib import Path
 import tensorflow as tf
@@ -26,6 +30,17 @@ if __name__ == '__main__':
     parser.add_argument("--epochs", type=int, default=400) # TracknetV3 only use 30
     parser.add_argument("--batch_size", type=int, default=3) # 2 change to ?, the batch_size increasing will cause the processing time increasing
     parser.add_argument("--load_model_status", type=str, default=False)
+    parser.add_argument("--frame_store", type=str, default=None, help="directory written by frame_store.py for the same input size, instead of the JPEGs")
+    parser.add_argument("--stamp_labels", action='store_true', help="draw the heatmaps from the label coordinates instead of reading dataset/gaussian_heatmap")
+    parser.add_argument("--shards", type=str, default=None, help="directory written by shards.py for the same input size, read sequentially with tf.data")
+    parser.add_argument("--videos", type=str, default=None, help="directory of labelled videos (<clip>.mp4 and <clip>.csv) to train on instead of dataset/images; "
+                                                                  "the validation then uses --val_videos, without --val_videos there is no ValidationCallback")
+    parser.add_argument("--val_videos", type=str, default=None, help="directory of held-out labelled videos to validate on instead of labels_val.csv and dataset/images")
+    parser.add_argument("--resident_clips", type=int, default=0, help="draw the batches of TrackNetDataset from this number of clips at a time, 0 for the order of labels_train.csv")
+    parser.add_argument("--frame_cache_mb", type=int, default=0, help="size of the shared cache of decoded frames of TrackNetDataset, 0 for no cache")
+    parser.add_argument("--workers", type=int, default=1, help="number of loaders of the batches of TrackNetDataset")
+    parser.add_argument("--use_multiprocessing", action='store_true', help="run the loaders of TrackNetDataset in processes instead of threads")
+    parser.add_argument("--tf_data", action='store_true', help="build the batches with tf.data (parallel decoding and prefetching) instead of TrackNetDataset")
     parser.add_argument("--steps_per_epoch", type=int, default=200) # 200 change to 300, which means more films(batches) are trained.
 
     args = parser.parse_args()
@@ -44,9 +59,25 @@ if __name__ == '__main__':
     
     model.compile(loss=WBCE_loss, optimizer=optimizer_name, metrics=['accuracy']) 
     
-    train_dataset = TrackNetDataset(input_height, input_width, batch_size)
+    frame_store = FrameStore(args.frame_store) if args.frame_store else None
+    stamper = HeatmapStamper(input_height, input_width) if args.stamp_labels else None
+    if args.videos:
+        train_dataset = video_dataset(args.videos, input_height, input_width, batch_size, stamper)
+    elif args.shards:
+        train_dataset = shard_dataset(args.shards, input_height, input_width, batch_size, stamper)
+    elif args.tf_data:
+        train_dataset = tf_dataset(input_height, input_width, batch_size, frame_store, stamper=stamper)
+    else:
+        frame_cache = SharedFrameCache(input_height, input_width, args.frame_cache_mb * 2**20) if args.frame_cache_mb else None
+        train_dataset = TrackNetDataset(input_height, input_width, batch_size, frame_store, stamper,
+                                        args.resident_clips, frame_cache, args.workers, args.use_multiprocessing)
     # stop_early = tf.keras.callbacks.EarlyStopping(monitor='loss', patience=10)
-    validation_callback = ValidationCallback() # This was created by the author for viewing the training results in figures at media
+    if args.val_videos:
+        validation_callback = ValidationCallback(stamper=stamper, video_clips=video_clips(args.val_videos))
+    elif args.videos: # labels_val.csv refers to the JPEGs of dataset/images, which are not used with --videos
+        validation_callback = None
+    else:
+        validation_callback = ValidationCallback(frame_store, stamper) # This was created by the author for viewing the training results in figures at media
     tensorboard_callback = tf.keras.callbacks.TensorBoard(log_dir="logs",
                                                           histogram_freq=1,
                                                           profile_batch='20,180')
@@ -61,7 +92,7 @@ if __name__ == '__main__':
               # max_queue_size=10,
               # workers=2,
               # use_multiprocessing=True,
-              callbacks=[model_checkpoint,validation_callback]
+              callbacks=[model_checkpoint] + ([validation_callback] if validation_callback else [])
               )
     
     # model.save(f'{save_model_path}/tracknet.keras')
@@ -4,11 +4,20 @@ import time
 from keras import ops
 import tensorflow as tf
 import keras.backend as K
+from labels import HeatmapStamper, disk_kernel
 
-def heatMap(prediction, n_classes, model_height, model_width, output_height, output_width):
-    """ Use the cv2.threshold and HoughCircles to get the ball centre"""
+def model_input_size(model):
+    """ Input height and width of a TrackNet model, read from its input shape (batch, 9, height, width).
+    Works for keras models and exported models (see ExportedModel in export.py)."""
+    return int(model.input_shape[2]), int(model.input_shape[3])
+
+def heatMap(prediction, n_classes, model_height, model_width, output_height, output_width, with_peak=False):
+    """ Use the cv2.threshold and HoughCircles to get the ball centre
+        with_peak: also return the highest heatmap level in [0, 1], from the same argmax, as a confidence
+    """
 
     prediction = prediction.reshape((model_height, model_width, n_classes)).argmax(axis=2) # loss= sparceCategoricalCrossEntropy
+    peak = float(prediction.max()) / (n_classes - 1) if with_peak else None
     
     prediction = prediction.astype(np.uint8)
 
@@ -22,12 +31,17 @@ def heatMap(prediction, n_classes, model_height, model_width, output_height, out
             x = int(circles[0][0][0])
             y = int(circles[0][0][1])
     
+    if with_peak:
+        return x, y, peak
     return x, y
 
 ## This is for WBCE_loss
-def heatMap_1(prediction, model_height, model_width, output_height, output_width):
-    """ Use the cv2.threshold and HoughCircles to get the ball centre"""
+def heatMap_1(prediction, model_height, model_width, output_height, output_width, with_peak=False):
+    """ Use the cv2.threshold and HoughCircles to get the ball centre
+        with_peak: also return the highest sigmoid output, as a confidence
+    """
   
+    peak = float(prediction.max()) if with_peak else None
     prediction = prediction > 0.5
     prediction = prediction.astype('float32')
     prediction = prediction * 255
@@ -48,8 +62,24 @@ def heatMap_1(prediction, model_height, model_width, output_height, output_width
             x = float(circles[0][0][0])
             y = float(circles[0][0][1])
         
+    if with_peak:
+        return x, y, peak
     return x, y
 
+## This is for the serving head (HeatmapPeak in model.py)
+def heatMap_peak(prediction, model_height, model_width, output_height, output_width, min_conf=0.1):
+    """ Scale the (x, y, confidence) decoded inside the graph to the output frame
+        min_conf: fraction of the 5x5 peak window of HeatmapPeak the blob must fill, 0.1 keeps blobs of at least
+                  3 pixels at model resolution, the smallest circle heatMap accepts (radius 2 in 1280x720),
+                  a stray pixel (1/25) is no detection
+    """
+
+    x, y, conf = prediction
+    if conf <= min_conf:
+        return None, None
+    # pixel centres as in the cv2.resize of heatMap
+    return float((x + 0.5) * output_width / model_width - 0.5), float((y + 0.5) * output_height / model_height - 0.5)
+
 
 def binary_heatMap(prediction, ratio=2):
 
@@ -107,24 +137,17 @@ def get_output(height, width, path_gt):
     img = np.reshape(img, (width* height))
     return img
 
-def generate_binary_heatmap(cx, cy, r, mag):
-        height = 360
-        width = 640
-        
-        if vis > 0:
-            cx = int(float(cx.strip()))
-            cy = int(float(cy.strip()))
-
-        else:
-            return np.zeros((1, height, width))
-        
-        x, y = np.meshgrid(np.linspace(1, width, width), np.linspace(1, height, height))
-        heatmap = ((y - (cy + 1))**2) + ((x - (cx + 1))**2) # ?
-        heatmap[heatmap <= r**2] = 1
-        heatmap[heatmap > r**2] = 0
-        y = heatmap*mag
-        y = np.reshape(y, (1, height, width))
-        return y
+def generate_binary_heatmap(cx, cy, r, mag, height=360, width=640):
+    """ Disk of radius r and value mag around the ball point (cx, cy) of the model resolution
+    :return
+        heatmap of shape (1, height, width), zeros if the ball is not visible (negative or empty coordinates)
+    """
+    cx = float(cx) if cx != '' else -1
+    cy = float(cy) if cy != '' else -1
+    if not cx >= 0 or not cy >= 0: # also NaN
+        return np.zeros((1, height, width))
+    stamper = HeatmapStamper(height, width, height, width, kernel=disk_kernel(r))
+    return stamper.stamp(cx, cy, 1).reshape(1, height, width) * mag
 
 
 def WBCE_loss(y_true, y_pred): 
@@ -0,0 +1,67 @@
+## Training samples read from the match videos, without the per-frame JPEGs of dataset/images. Every clip is a video
+# with its labels next to it, <dir>/<clip>.mp4 and <dir>/<clip>.csv in the format of Label.csv (file name, visibility,
+# x-coordinate, y-coordinate, status) with one row per frame of the video. The videos are decoded in windows of
+# consecutive frames, every frame once per epoch, and every labelled frame of a window gives one sample.
+
+import os
+import numpy as np
+import pandas as pd
+import cv2
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+
+def video_clips(path_videos):
+    """ (video, labels) paths of every video under path_videos that has a labels CSV"""
+    clips = []
+    for path_dir, _, files in sorted(os.walk(path_videos)):
+        for file_name in sorted(files):
+            stem, extension = os.path.splitext(file_name)
+            path_labels = os.path.join(path_dir, stem + '.csv')
+            if extension.lower() in VIDEO_EXTENSIONS and os.path.exists(path_labels):
+                clips.append((os.path.join(path_dir, file_name), path_labels))
+    return clips
+
+
+def read_video_samples(path_video, path_labels, input_height=360, input_width=640, output_height=720,
+                       output_width=1280, window=64):
+    """ Decode a video in windows and make the samples of its labelled frames
+    :params
+        path_video, path_labels: a clip of video_clips
+        input_height, input_width: model resolution
+        output_height, output_width: resolution the ball coordinates are scaled to, the one of the HeatmapStamper
+        window: number of frames decoded before their samples are made, the last 2 frames are kept for the next window
+    :return
+        generator of (uint8 input (9, input_height, input_width), float32 (x, y, visibility)) in frame order,
+        x and y are NaN if the ball is not visible
+    """
+    if isinstance(path_video, bytes): # from tf.data
+        path_video, path_labels = path_video.decode(), path_labels.decode()
+    labels = pd.read_csv(path_labels)
+    cap = cv2.VideoCapture(path_video)
+    scale_x = output_width / cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+    scale_y = output_height / cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+    visible = labels['visibility'].values != 0
+    coordinates = np.stack([np.where(visible, labels['x-coordinate'].values * scale_x, np.nan),
+                            np.where(visible, labels['y-coordinate'].values * scale_y, np.nan),
+                            labels['visibility'].values], axis=1).astype(np.float32)
+
+    frames = np.empty((window + 2, 3, input_height, input_width), dtype=np.uint8)
+    num = 0 # number of frames in frames
+    first = 0 # video frame number of frames[0]
+    try:
+        while first + 2 < len(labels): # frames after the last label are not read
+            ret, frame = cap.read()
+            if ret:
+                frames[num] = cv2.resize(frame, (input_width, input_height)).transpose(2, 0, 1) # "channels_first"
+                num += 1
+            if num > 2 and (num == len(frames) or not ret):
+                for i in range(2, min(num, len(labels) - first)):
+                    yield frames[[i, i-1, i-2]].reshape(9, input_height, input_width), coordinates[first + i]
+                frames[:2] = frames[num-2:num] # the previous 2 frames of the next window
+                first += num - 2
+                num = 2
+            if not ret:
+                break
+    finally:
+        cap.release()